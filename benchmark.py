@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from device import DeviceTemplate, ExportWriter
+from json_backend import JSON_BACKENDS, available_backends
+from json_to_asset import Parser, open_reports
+from logging_config import setup_logging
+from processing import process_folder
+from report_generator import write_export
+
+# Report counts benchmarked by default
+DEFAULT_SIZES = [10, 1000, 10000]
+# Relative slowdown against the baseline reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+# Runs function repeat times, returns the median seconds and the item count it returned
+def measure(function, repeat: int):
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), items
+
+
+# Parsed components of each report, so compile can be measured on its own
+def parse_components(parser: Parser, input_file: str) -> list:
+    with open(input_file, 'r') as file:
+        reports = json.load(file)['PCProduct']
+
+    components = []
+    for report in reports:
+        if report.get("'A' Number") == "N/A" or report.get('Asset ID') == "N/A":
+            continue
+        components.append((report.get("Securaze User"), parser.parse_comp(report), parser.parse_cpus(report),
+                           parser.parse_hdds(report), parser.parse_battery(report), parser.parse_memory(report)))
+    return components
+
+
+def bench_parse(parser: Parser, input_file: str):
+    return lambda: len(parser.parse_file(input_file))
+
+
+# Reads and decodes the reports of the export with a json_backend, without parsing them
+def bench_load(input_file: str, backend: str):
+    def run():
+        with open_reports(input_file, backend) as reports:
+            return sum(1 for _ in reports)
+    return run
+
+
+# Builds and compiles the devices and produces their export rows
+def bench_compile(components: list):
+    def run():
+        for location, comp, cpus, hdds, battery, memory in components:
+            device = DeviceTemplate(location, comp, cpus, hdds, battery, memory)
+            device.compile()
+            for _ in device.rows():
+                pass
+        return len(components)
+    return run
+
+
+def bench_export(devices: list, output_directory: str, batched: bool):
+    def run():
+        if batched:
+            with ExportWriter(output_directory) as writer:
+                for device in devices:
+                    writer.add(device)
+        else:
+            for device in devices:
+                device.export(output_directory)
+        return len(devices)
+    return run
+
+
+# Processes files copies of the export through process_folder, recreating the input directory each run
+def bench_folder(input_file: str, work_directory: str, files: int, workers: int):
+    input_directory = os.path.join(work_directory, 'in', '')
+    output_directory = os.path.join(work_directory, 'out', '')
+    archive_directory = os.path.join(work_directory, 'archive', '')
+
+    def run():
+        for directory in (input_directory, output_directory, archive_directory):
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+        for number in range(files):
+            shutil.copy(input_file, f'{input_directory}report_{number}.json')
+        return process_folder(input_directory, output_directory, archive_directory, workers=workers)['devices']
+    return run
+
+
+# Runs every stage for each size, returns {"<stage>@<size>": {"seconds": ..., "per_second": ...}}.
+# load:<backend> and parse:<backend> are run for each of json_backends on the same export.
+def run_benchmarks(sizes: list, repeat: int, files: int, workers: int, seed: int,
+                   json_backends: list = None) -> dict:
+    results = {}
+    parser = Parser()
+    if json_backends is None:
+        json_backends = available_backends()
+    with tempfile.TemporaryDirectory(prefix='se_bench_') as work_directory:
+        for size in sizes:
+            input_file = os.path.join(work_directory, f'export_{size}.json')
+            write_export(input_file, size, seed=seed)
+            output_directory = os.path.join(work_directory, f'out_{size}', '')
+            os.makedirs(output_directory)
+
+            devices = parser.parse_file(input_file)
+            stages = {"parse": bench_parse(parser, input_file),
+                      "compile": bench_compile(parse_components(parser, input_file)),
+                      "export": bench_export(devices, output_directory, batched=False),
+                      "export_batched": bench_export(devices, output_directory, batched=True),
+                      "folder": bench_folder(input_file, os.path.join(work_directory, f'folder_{size}'),
+                                             files, workers)}
+            for backend in json_backends:
+                stages[f'load:{backend}'] = bench_load(input_file, backend)
+                stages[f'parse:{backend}'] = bench_parse(Parser(json_backend=backend), input_file)
+
+            for stage, function in stages.items():
+                seconds, items = measure(function, repeat)
+                results[f'{stage}@{size}'] = {"seconds": round(seconds, 6),
+                                              "items": items,
+                                              "per_second": round(items / seconds, 1) if seconds else 0.0}
+                print(f"{stage + '@' + str(size):<24} {seconds:>10.4f}s {items:>8} items "
+                      f"{results[f'{stage}@{size}']['per_second']:>12.1f}/s")
+
+            shutil.rmtree(output_directory, ignore_errors=True)
+    return results
+
+
+# Prints the change of each benchmark against a saved baseline, returns the regressed benchmarks
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    regressions = []
+    print(f"\n{'benchmark':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        after = result['seconds']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<24} {before:>9.4f}s {after:>9.4f}s {change:>+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Benchmark parse, compile, export and folder processing")
+    arg_parser.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES,
+                            help="Report counts per export (default: 10 1000 10000)")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the median is kept")
+    arg_parser.add_argument("--files", type=int, default=4, help="Files processed by the folder benchmark")
+    arg_parser.add_argument("--workers", type=int, default=1, help="Workers of the folder benchmark")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic exports")
+    arg_parser.add_argument("--json-backends", nargs='+', choices=JSON_BACKENDS, default=None,
+                            help="JSON backends timed on the same exports (default: all installed)")
+    arg_parser.add_argument("--save", help="Write the results to this baseline file")
+    arg_parser.add_argument("--compare", help="Compare the results with this baseline file")
+    arg_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                            help="Slowdown reported as a regression (default: 0.10)")
+    args = arg_parser.parse_args()
+
+    setup_logging()
+    results = run_benchmarks(args.sizes, args.repeat, args.files, args.workers, args.seed, args.json_backends)
+
+    regressed = []
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            regressed = compare(results, json.load(baseline_file)['results'], args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({"sizes": args.sizes, "repeat": args.repeat, "files": args.files, "workers": args.workers,
+                       "seed": args.seed, "results": results}, baseline_file, indent=2)
+
+    if regressed:
+        raise SystemExit(f"{len(regressed)} benchmarks regressed: {', '.join(regressed)}")
@@ -0,0 +1,135 @@
+import csv
+import datetime
+import logging
+import os
+import secrets
+import uuid
+
+from json_to_asset import WIPE_SUCCESSFUL, Parser, battery_status, open_reports
+from quarantine import describe_error
+
+logger = logging.getLogger(__name__)
+
+# Names of the 15 columns of DeviceTemplate.rows, the meaning of field_5 to field_15 depends on record_type
+COLUMNS = ('location', 'computer_id', 'record_type', 'component_id') + tuple(f'field_{number}'
+                                                                              for number in range(5, 16))
+
+# Positions of the values converted for the whole batch at once
+_WIPE_STATUS_NUMBER = 7
+_WIPE_STATUS = 9
+
+
+# PASSED/FAILED and 1/0 for each raw Data Wipe result
+def wipe_statuses(results: list):
+    passed = [result == WIPE_SUCCESSFUL for result in results]
+    return ['PASSED' if ok else 'FAILED' for ok in passed], ['1' if ok else '0' for ok in passed]
+
+
+# Converts the reports of one export into the 15 columns of the comp, cpu, hd, bat and mem records.
+# Rows are collected per report; the wipe statuses are filled in for the whole batch. The battery status
+# comes from json_to_asset.battery_status like in the txt export, so a health value that fails there
+# fails here. A report that fails to parse adds no rows and is passed to on_error(report, reason, traceback).
+def reports_to_columns(parser: Parser, reports, on_error=None) -> dict:
+    rows = []
+    wipe_results = []
+    wipe_rows = []
+
+    for report in reports:
+        try:
+            if report.get("'A' Number") == "N/A" or report.get('Asset ID') == "N/A":
+                continue
+            comp = parser.parse_comp(report)
+            cpus = parser.parse_cpus(report)
+            storage = parser.iter_storage(report)
+            memory = parser.parse_memory(report)
+            health = report.get('Battery Health', 0)
+            battery = battery_status(health, report)
+        except Exception as error:
+            reason, details = describe_error(error)
+            logger.error("Report of %s failed to parse: %s",
+                         report.get('Serial Number') if isinstance(report, dict) else None, reason)
+            if on_error is not None:
+                on_error(report, reason, details)
+            continue
+
+        location = report.get("Securaze User")
+        computer_id = str(uuid.uuid1()).upper()
+
+        rows.append((location, computer_id, 'comp', '', comp.serial, comp.memory, comp.manufacturer, comp.model,
+                     comp.barcode, comp.manufacturer, '', '', comp.anumber, '', ''))
+
+        for cpu in cpus:
+            rows.append((location, computer_id, 'cpu', cpu.id, cpu.description, cpu.cores, cpu.type_code,
+                         cpu.speed, cpu.model, '', '', '', '', '', ''))
+
+        for (number, type, model, size, serial, employee, wipe_result, wipe_method, wipe_started,
+             wipe_finished) in storage:
+            wipe_rows.append(len(rows))
+            wipe_results.append(wipe_result)
+            rows.append((location, computer_id, 'hd', f'hdd{number}', serial, size, '1', None, employee, None,
+                         wipe_started, wipe_finished, type, wipe_method, ''))
+
+        health = health if isinstance(health, str) else str(health)
+        rows.append((location, computer_id, 'bat', 'bat', '', '', '', battery, '', '', '', '', '', '', health))
+
+        rows.append((location, computer_id, 'mem', 'mem', memory.capacity, memory.type,
+                     '', '', '', '', '', '', '', '', ''))
+
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in COLUMNS]
+
+    statuses, numbers = wipe_statuses(wipe_results)
+    for row, status, number in zip(wipe_rows, statuses, numbers):
+        columns[_WIPE_STATUS][row] = status
+        columns[_WIPE_STATUS_NUMBER][row] = number
+
+    return dict(zip(COLUMNS, columns))
+
+
+def _write_csv(columns: dict, path: str) -> None:
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*columns.values()))
+
+
+def _write_parquet(columns: dict, path: str) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("The parquet output format requires pyarrow")
+
+    table = pa.table({name: pa.array([value if value is None or isinstance(value, str) else str(value)
+                                      for value in values], pa.string())
+                      for name, values in columns.items()})
+    pq.write_table(table, path)
+
+
+# Converts one input file and writes it as a single csv or parquet file into the output directory,
+# returns the number of devices. Written under a temporary name and renamed once complete. Reports that
+# fail to parse are passed to on_error(report, reason, traceback).
+def export_columnar(parser: Parser, input_file: str, output_directory: str, output_format: str,
+                    on_error=None) -> int:
+    if output_format not in ('csv', 'parquet'):
+        raise ValueError(f"Unsupported columnar output format '{output_format}'")
+
+    with open_reports(input_file, parser.json_backend) as reports:
+        columns = reports_to_columns(parser, reports, on_error)
+
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    file_name = f'SE_{datetime.date.today().strftime("%m-%d-%Y")}_{stem}_{secrets.token_hex(4)}.{output_format}'
+    temp_path = f'{output_directory}.{file_name}.tmp'
+    try:
+        if output_format == 'csv':
+            _write_csv(columns, temp_path)
+        else:
+            _write_parquet(columns, temp_path)
+        os.replace(temp_path, f'{output_directory}{file_name}')
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    devices = columns['record_type'].count('comp')
+    logger.info("Created file %s with %d devices from '%s'", file_name, devices, input_file)
+    return devices
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+
+from defaults import (CONFIG_PATH_VARIABLE, DEFAULT_CONFIG_PATH, DEFAULT_INDEX_PATH, DEFAULT_OUTPUT_FORMAT,
+                      EXPORT_BATCH_BYTES, EXPORT_BATCH_DEVICES, LEASE_TTL, OUTPUT_FORMATS, STABLE_INTERVAL)
+from json_backend import DEFAULT_JSON_BACKEND, JSON_BACKENDS, load_json
+
+logger = logging.getLogger(__name__)
+
+# io_config keys holding the directories, and the keys they are returned under
+DIRECTORY_KEYS = {"input_directory": "input", "output_directory": "output", "archive_directory": "archive"}
+
+# Defaults of the optional io_config keys
+DEFAULTS = {"workers": 1,
+            "concurrency": 4,
+            "batch_size": EXPORT_BATCH_DEVICES,
+            "batch_bytes": EXPORT_BATCH_BYTES,
+            "index_path": DEFAULT_INDEX_PATH,
+            "metrics_path": None,
+            "metrics_port": None,
+            "output_format": DEFAULT_OUTPUT_FORMAT,
+            "shard_size": 0,
+            "spool_directory": None,
+            "profile_directory": None,
+            "json_backend": DEFAULT_JSON_BACKEND,
+            "stable_interval": STABLE_INTERVAL,
+            "claim_files": False,
+            "node_id": None,
+            "lease_ttl": LEASE_TTL,
+            "daemon_key": None}
+
+# Integer keys and their smallest valid value
+INTEGER_KEYS = {"workers": 0, "concurrency": 1, "batch_size": 1, "batch_bytes": 1, "shard_size": 0}
+
+_lock = threading.Lock()
+# Path -> ((mtime, size), config)
+_cache = {}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+# Config file to use: the given path, then SECURE_ERASE_CONFIG, then default_path
+def resolve_config_path(path: str = None, default_path: str = DEFAULT_CONFIG_PATH) -> str:
+    return path or os.environ.get(CONFIG_PATH_VARIABLE) or default_path
+
+
+# Validates io_config and returns the directories, each ending with '/', under input/output/archive
+# along with the optional keys and their defaults
+def normalize_config(raw: dict) -> dict:
+    io_config = raw.get('io_config') if isinstance(raw, dict) else None
+    if not isinstance(io_config, dict):
+        raise ConfigError("Config has no 'io_config' section")
+
+    config = dict(DEFAULTS)
+    config.update({key: value for key, value in io_config.items() if key not in DIRECTORY_KEYS})
+
+    for name, key in DIRECTORY_KEYS.items():
+        directory = io_config.get(name)
+        if not isinstance(directory, str) or not directory:
+            raise ConfigError(f"'{name}' is missing from io_config")
+        if not directory.endswith("/"):
+            directory = directory + '/'
+        config[key] = directory
+
+    # Local directory the exports are written to before they are moved to output
+    spool_directory = config['spool_directory']
+    if spool_directory is not None:
+        if not isinstance(spool_directory, str) or not spool_directory:
+            raise ConfigError("'spool_directory' must be a directory")
+        if not spool_directory.endswith("/"):
+            config['spool_directory'] = spool_directory + '/'
+
+    for key, minimum in INTEGER_KEYS.items():
+        if not isinstance(config[key], int) or config[key] < minimum:
+            raise ConfigError(f"'{key}' must be an integer of at least {minimum}")
+
+    if config['output_format'] not in OUTPUT_FORMATS:
+        raise ConfigError(f"'output_format' must be one of {', '.join(OUTPUT_FORMATS)}")
+
+    for key, minimum in (('stable_interval', 0), ('lease_ttl', 1)):
+        value = config[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+            raise ConfigError(f"'{key}' must be a number of seconds of at least {minimum}")
+
+    # Nodes sharing the input directory claim files before processing them, see leases.FileClaims
+    if not isinstance(config['claim_files'], bool):
+        raise ConfigError("'claim_files' must be true or false")
+    node_id = config['node_id']
+    if node_id is not None and (not isinstance(node_id, str) or not node_id or set(node_id) & set('/\\:')):
+        raise ConfigError("'node_id' must be a name usable as a directory name")
+
+    # Shared key of the parser daemon and its clients, see daemon_client.daemon_key
+    daemon_key = config['daemon_key']
+    if daemon_key is not None and (not isinstance(daemon_key, str) or not daemon_key):
+        raise ConfigError("'daemon_key' must be a non-empty string")
+
+    if config['json_backend'] not in JSON_BACKENDS:
+        raise ConfigError(f"'json_backend' must be one of {', '.join(JSON_BACKENDS)}")
+
+    return config
+
+
+# Directories of the config that do not exist (yet), e.g. a share that is not connected
+def missing_directories(config: dict) -> list:
+    return [config[key] for key in DIRECTORY_KEYS.values() if not os.path.isdir(config[key])]
+
+
+# Loads the config, read again only when the file's mtime or size changed. The returned dict is shared
+# between callers and must not be modified; a reload returns a new one, so `is` tells whether it changed.
+def load_config(path: str = None, default_path: str = DEFAULT_CONFIG_PATH) -> dict:
+    path = resolve_config_path(path, default_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    config = normalize_config(load_json(path))
+
+    for directory in missing_directories(config):
+        logger.warning("Configured directory '%s' does not exist", directory)
+
+    with _lock:
+        _cache[path] = (version, config)
+    logger.info("Loaded config '%s'", path)
+    return config
+
+
+# load_config for the entry points, None when the file does not exist
+def get_config(path: str = None, default_path: str = DEFAULT_CONFIG_PATH):
+    try:
+        return load_config(path, default_path)
+    except FileNotFoundError:
+        print("Config file doesn't exist")
+        return None
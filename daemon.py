@@ -0,0 +1,215 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from daemon_client import (DaemonKeyError, add_address_argument, add_client_commands, daemon_address, daemon_key,
+                           run_client, send_request)
+from defaults import CONFIG_PATH_VARIABLE, JSON_TO_ASSET_CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonRunningError(RuntimeError):
+    pass
+
+
+# Long running parser process. It keeps the modules, a warm Parser, the log handlers and the processed
+# index loaded and runs "process this file or directory" jobs received over a local socket, one job
+# at a time. The config file is checked on every job, so changes apply without a restart. Clients use
+# daemon_client, which is built as its own executable without the parser modules.
+class ParseDaemon:
+    def __init__(self, address: str = None, config_path: str = None):
+        from json_to_asset import Parser
+
+        self.address = daemon_address(address)
+        self.key = daemon_key(config_path)
+        self.config_path = config_path
+        self.default_config_path = JSON_TO_ASSET_CONFIG_PATH
+        self.parser = Parser()
+        self.index = None
+        self.transfer = None
+        self.jobs = 0
+        self.started = time.time()
+        self._job_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listener = None
+
+    def _config(self) -> dict:
+        from config import load_config
+
+        return load_config(self.config_path, self.default_config_path)
+
+    # Processed index of the config, reopened when the configured path changes
+    def _index(self, config: dict):
+        from processed_index import ProcessedIndex
+
+        if not config['index_path']:
+            return None
+        if self.index is None or self.index.path != config['index_path']:
+            if self.index is not None:
+                self.index.close()
+            self.index = ProcessedIndex(config['index_path'])
+        return self.index
+
+    # Directory the jobs export into: the spool, whose files a background SpoolTransfer moves to the
+    # output directory, or the output directory itself
+    def _export_directory(self, config: dict) -> str:
+        from spool import SpoolTransfer
+
+        target = (config['spool_directory'], config['output'])
+        if self.transfer is not None and (self.transfer.spool_directory, self.transfer.output_directory) != target:
+            self.transfer.stop(drain=False)
+            self.transfer = None
+        if config['spool_directory'] and self.transfer is None:
+            self.transfer = SpoolTransfer(config['spool_directory'], config['output']).start()
+        return config['spool_directory'] or config['output']
+
+    # Processes one file with the warm parser, or every file of a directory (the configured input
+    # directory when path is empty) through process_folder
+    def process(self, path: str = None, workers=None) -> dict:
+        from processing import process_file, process_folder
+
+        config = self._config()
+        self.parser.json_backend = config['json_backend']
+        path = path or config['input']
+        output_directory = self._export_directory(config)
+        started = time.perf_counter()
+
+        if os.path.isdir(path):
+            return process_folder(os.path.join(path, ''), output_directory, config['archive'],
+                                  workers=config['workers'] if workers is None else workers,
+                                  batch_size=config['batch_size'], batch_bytes=config['batch_bytes'],
+                                  index_path=config['index_path'], metrics_path=config['metrics_path'],
+                                  output_format=config['output_format'], shard_size=config['shard_size'],
+                                  profile_directory=config['profile_directory'],
+                                  json_backend=config['json_backend'],
+                                  stable_interval=config['stable_interval'],
+                                  claim_files=config['claim_files'], node_id=config['node_id'],
+                                  lease_ttl=config['lease_ttl'])
+
+        if not self.parser.can_parse(path):
+            raise ValueError(f"'{path}' is not a Securaze export")
+        devices = process_file(self.parser, path, output_directory, config['archive'],
+                               batch_size=config['batch_size'], batch_bytes=config['batch_bytes'],
+                               index=self._index(config), output_format=config['output_format'],
+                               profile_directory=config['profile_directory'])
+        return {"files": 1, "failed": 0, "devices": devices, "seconds": round(time.perf_counter() - started, 3)}
+
+    def _handle(self, request: dict) -> dict:
+        command = request.get('command')
+        if command == 'ping':
+            return {"ok": True, "pid": os.getpid(), "jobs": self.jobs, "uptime": round(time.time() - self.started)}
+        if command == 'stop':
+            # Stopped by _serve_connection once the reply is sent
+            return {"ok": True}
+        if command == 'process':
+            with self._job_lock:
+                self.jobs += 1
+                logger.info("Job %d: processing '%s'", self.jobs, request.get('path') or 'input directory')
+                return {"ok": True, "summary": self.process(request.get('path'), request.get('workers'))}
+        raise ValueError(f"Unknown command '{command}'")
+
+    def _serve_connection(self, connection) -> None:
+        with connection:
+            try:
+                request = connection.recv()
+                try:
+                    reply = self._handle(request)
+                except Exception as error:
+                    logger.error("Request %s failed: %s", request, error)
+                    reply = {"ok": False, "error": str(error)}
+                connection.send(reply)
+            except (EOFError, OSError) as error:
+                logger.warning("Client connection lost: %s", error)
+                return
+        if request.get('command') == 'stop':
+            self.stop()
+
+    def stop(self) -> None:
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        # Wakes up the accept() of serve_forever
+        try:
+            Client(self.address, authkey=self.key).close()
+        except OSError:
+            pass
+
+    # Raises DaemonRunningError when a daemon answers on the address. A socket nobody listens on was left
+    # behind by a daemon that did not shut down cleanly and is removed.
+    def _claim_address(self) -> None:
+        try:
+            send_request({"command": "ping"}, self.address, self.key)
+        except AuthenticationError:
+            raise DaemonRunningError(f"A daemon with another key is listening on '{self.address}'")
+        except (OSError, EOFError):
+            if os.name != 'nt' and os.path.exists(self.address):
+                os.remove(self.address)
+            return
+        raise DaemonRunningError(f"A parser daemon is already listening on '{self.address}'")
+
+    def serve_forever(self) -> None:
+        self._claim_address()
+        self._listener = Listener(self.address, authkey=self.key)
+        if os.name != 'nt':
+            os.chmod(self.address, 0o600)
+        logger.info("Parser daemon listening on '%s'", self.address)
+
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection = self._listener.accept()
+                except (AuthenticationError, OSError) as error:
+                    if not self._stopping.is_set():
+                        logger.warning("Rejected connection: %s", error)
+                    continue
+                if self._stopping.is_set():
+                    connection.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(connection,), name='daemon-client',
+                                 daemon=True).start()
+        finally:
+            # A job still running finishes before the index is closed
+            with self._job_lock:
+                self._listener.close()
+                if self.index is not None:
+                    self.index.close()
+                if self.transfer is not None:
+                    self.transfer.stop()
+            logger.info("Parser daemon stopped")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Resident Secure Erase parser and its client")
+    add_address_argument(arg_parser)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="Run the daemon in the foreground")
+    serve_parser.add_argument("--config", help=f"Config file (default: ${CONFIG_PATH_VARIABLE} or "
+                                               f"{JSON_TO_ASSET_CONFIG_PATH})")
+    add_client_commands(commands)
+    args = arg_parser.parse_args()
+
+    if args.command != 'serve':
+        sys.exit(run_client(args))
+
+    import multiprocessing
+
+    from logging_config import setup_logging
+
+    # Needed by the worker processes of the frozen executable
+    multiprocessing.freeze_support()
+    setup_logging()
+    try:
+        daemon = ParseDaemon(args.address, args.config)
+        daemon.serve_forever()
+    except (DaemonKeyError, DaemonRunningError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(2)
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+from defaults import CONFIG_PATH_VARIABLE, JSON_TO_ASSET_CONFIG_PATH
+
+# Client of the resident parser (daemon.py serve). It is built as its own small executable and only
+# imports multiprocessing.connection, so each call starts in milliseconds however large the parser is.
+
+# Named pipe on Windows, Unix socket elsewhere. SECURE_ERASE_DAEMON_ADDRESS overrides it.
+ADDRESS_VARIABLE = 'SECURE_ERASE_DAEMON_ADDRESS'
+if os.name == 'nt':
+    DEFAULT_DAEMON_ADDRESS = r'\\.\pipe\SecureEraseParser'
+else:
+    DEFAULT_DAEMON_ADDRESS = os.path.join(tempfile.gettempdir(), 'secure_erase_parser.sock')
+
+# Shared key the client and daemon authenticate each other with, see daemon_key
+KEY_VARIABLE = 'SECURE_ERASE_DAEMON_KEY'
+
+
+class DaemonKeyError(ValueError):
+    pass
+
+
+def daemon_address(address: str = None) -> str:
+    return address or os.environ.get(ADDRESS_VARIABLE) or DEFAULT_DAEMON_ADDRESS
+
+
+# Key of the daemon: SECURE_ERASE_DAEMON_KEY, otherwise 'daemon_key' of the io_config in the config file
+# (config_path, SECURE_ERASE_CONFIG or the converter's config). There is no built-in key, DaemonKeyError
+# is raised when neither is set. The file is read with json alone so the client stays small.
+def daemon_key(config_path: str = None) -> bytes:
+    key = os.environ.get(KEY_VARIABLE)
+    path = config_path or os.environ.get(CONFIG_PATH_VARIABLE) or JSON_TO_ASSET_CONFIG_PATH
+    if not key:
+        try:
+            with open(path, encoding='utf-8-sig') as file:
+                key = json.load(file)['io_config'].get('daemon_key')
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            key = None
+    if not key or not isinstance(key, str):
+        raise DaemonKeyError(f"No daemon key, set ${KEY_VARIABLE} or 'daemon_key' in the io_config of '{path}'")
+    return key.encode()
+
+
+# Sends one request to the daemon and returns its reply. Raises ConnectionError (or FileNotFoundError
+# for a missing socket) when no daemon is listening. key defaults to daemon_key().
+def send_request(request: dict, address: str = None, key: bytes = None) -> dict:
+    with Client(daemon_address(address), authkey=key or daemon_key()) as connection:
+        connection.send(request)
+        return connection.recv()
+
+
+def _print_summary(summary: dict) -> None:
+    print(f"Processed {summary['files']} files ({summary['failed']} failed) and {summary['devices']} devices "
+          f"in {summary['seconds']}s")
+
+
+# Adds the process, ping and stop commands to the subparsers of a command line
+def add_client_commands(commands) -> None:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help=f"Config file holding the daemon key when ${KEY_VARIABLE} is not set "
+                                         f"(default: ${CONFIG_PATH_VARIABLE} or {JSON_TO_ASSET_CONFIG_PATH})")
+    process_parser = commands.add_parser('process', parents=[common],
+                                         help="Process a file or directory and wait for the result")
+    process_parser.add_argument("path", nargs='?', help="Export file or directory (default: the input directory)")
+    process_parser.add_argument("--workers", type=int, default=None,
+                                help="Worker processes for a directory (default: config)")
+    commands.add_parser('ping', parents=[common], help="Check that the daemon is running")
+    commands.add_parser('stop', parents=[common], help="Stop the daemon once the current job is done")
+
+
+# Runs a command added by add_client_commands, returns the exit status
+def run_client(args) -> int:
+    request = {"command": args.command}
+    if args.command == 'process':
+        request.update(path=os.path.abspath(args.path) if args.path else None, workers=args.workers)
+    try:
+        reply = send_request(request, args.address, daemon_key(args.config))
+    except DaemonKeyError as error:
+        print(error, file=sys.stderr)
+        return 2
+    except (ConnectionError, FileNotFoundError) as error:
+        print(f"Parser daemon is not running: {error}", file=sys.stderr)
+        return 2
+    except AuthenticationError:
+        print(f"Parser daemon rejected the key, check ${KEY_VARIABLE}", file=sys.stderr)
+        return 2
+
+    if not reply.get('ok'):
+        print(f"Failed: {reply.get('error')}", file=sys.stderr)
+        return 1
+    if args.command == 'process':
+        _print_summary(reply['summary'])
+    elif args.command == 'ping':
+        print(f"Parser daemon {reply['pid']} up for {reply['uptime']}s, {reply['jobs']} jobs")
+    return 0
+
+
+def add_address_argument(arg_parser: argparse.ArgumentParser) -> None:
+    arg_parser.add_argument("--address", help=f"Socket or named pipe (default: ${ADDRESS_VARIABLE} or "
+                                              f"{DEFAULT_DAEMON_ADDRESS})")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Client of the resident Secure Erase parser")
+    add_address_argument(arg_parser)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    add_client_commands(commands)
+    sys.exit(run_client(arg_parser.parse_args()))
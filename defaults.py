@@ -0,0 +1,30 @@
+import os
+
+from logging_config import log_root
+
+# Defaults of the settings shared by config and the modules using them. Only imports leaf modules, so
+# config can read them without importing the parser, the index or the exporters.
+
+# Config file of the service and of the standalone converter and daemon, SECURE_ERASE_CONFIG or a
+# --config argument overrides them
+DEFAULT_CONFIG_PATH = 'C:/secure_erase/config.json'
+JSON_TO_ASSET_CONFIG_PATH = 'S:/ftp/Securaze/config.json'
+CONFIG_PATH_VARIABLE = 'SECURE_ERASE_CONFIG'
+
+# Output formats of a processed file, 'txt' is the SE_*.txt import format written by ExportWriter
+OUTPUT_FORMATS = ('txt', 'csv', 'parquet')
+DEFAULT_OUTPUT_FORMAT = 'txt'
+
+# Default rollover limits of a batched export file
+EXPORT_BATCH_DEVICES = 500
+EXPORT_BATCH_BYTES = 4 * 1024 * 1024
+
+# Default location of the processed index, next to the log files (C:/secure_erase on Windows). It has to
+# stay on a local disk as SQLite locking is unreliable on shares.
+DEFAULT_INDEX_PATH = os.path.join(log_root(), 'processed.db')
+
+# Seconds the size and mtime of an input file have to stay the same before it is processed
+STABLE_INTERVAL = 2.0
+
+# Seconds a lease is valid without being renewed, held leases are renewed every third of it
+LEASE_TTL = 120.0
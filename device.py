@@ -1,94 +1,165 @@
-from dataclasses import dataclass, field
+from collections import namedtuple
 import datetime
 import os
 import uuid
 import logging
 import secrets
 
-# logging.basicConfig(filename='C:/secure_erase/export.log', level=logging.INFO,
-#                     format='%(asctime)s %(levelname)s %(message)s')
+from defaults import EXPORT_BATCH_BYTES, EXPORT_BATCH_DEVICES
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-handler = logging.FileHandler('C:/secure_erase/export.log')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
-@dataclass
-class DeviceTemplate:
+# Parsed components of a device. Tuples keep a buffered device free of per-field dicts.
+Comp = namedtuple('Comp', 'serial memory manufacturer model barcode anumber')
+Cpu = namedtuple('Cpu', 'id description type_code model cores speed')
+Hdd = namedtuple('Hdd', 'id serial type model size employee wipe_status wipe_status_number wipe_method '
+                        'wipe_started wipe_finished')
+Battery = namedtuple('Battery', 'health status')
+Memory = namedtuple('Memory', 'capacity type')
+
+EMPTY_COMP = Comp(None, None, None, None, None, None)
+EMPTY_BATTERY = Battery(None, None)
+EMPTY_MEMORY = Memory(None, None)
+
 
-    _comp_vars: list = field(default_factory=list)
-    _cpu_vars: list = field(default_factory=list)
-    _hdd_vars: list = field(default_factory=list)
-    _battery_vars: list = field(default_factory=list)
-    _mem_vars: list = field(default_factory=list)
-    location: str = field(default_factory=str)
-    comp: dict = field(default_factory=dict)
-    cpus: list = field(default_factory=list)
-    hdds: list = field(default_factory=list)
-    battery: dict = field(default_factory=dict)
-    memory: dict = field(default_factory=dict)
-
-    # Converts dictionary to list for export
+# Compact record of one device. The 15 column export rows are produced from the component tuples
+# while exporting and are never stored.
+class DeviceTemplate:
+    __slots__ = ('location', 'computer_id', 'comp', 'cpus', 'hdds', 'battery', 'memory')
+
+    def __init__(self, location: str = '', comp: Comp = EMPTY_COMP, cpus: tuple = (), hdds: tuple = (),
+                 battery: Battery = EMPTY_BATTERY, memory: Memory = EMPTY_MEMORY):
+        self.location = location
+        self.computer_id = None
+        self.comp = comp
+        self.cpus = cpus
+        self.hdds = hdds
+        self.battery = battery
+        self.memory = memory
+
+    # Assigns the Computer Id, calling it again keeps the same one
     def compile(self):
-        # UUID as Computer Id
-        computer_id = str(uuid.uuid1()).upper()
+        if self.computer_id is None:
+            with metrics.timer('compile'):
+                # UUID as Computer Id
+                self.computer_id = str(uuid.uuid1()).upper()
+
+    # Yields the export rows: comp, cpus, hard drives, battery and memory
+    def rows(self):
+        location = self.location
+        computer_id = self.computer_id
+        comp = self.comp
 
-        self._comp_vars = [self.location, computer_id, 'comp', '', self.comp.get('serial'), self.comp.get('memory'),
-                     self.comp.get('manufacturer'), self.comp.get('model'), self.comp.get('barcode'),
-                     self.comp.get('manufacturer'), '', '', self.comp.get('anumber'), '', '']
+        yield (location, computer_id, 'comp', '', comp.serial, comp.memory, comp.manufacturer, comp.model,
+               comp.barcode, comp.manufacturer, '', '', comp.anumber, '', '')
 
         for cpu in self.cpus:
-            cpu_vars = [self.location, computer_id, 'cpu', cpu.get('id'), cpu.get('description'), cpu.get('cores'),
-                        cpu.get('type_code'), cpu.get('speed'), cpu.get('model'), '', '', '', '', '', '']
-            self._cpu_vars.append(cpu_vars)
+            yield (location, computer_id, 'cpu', cpu.id, cpu.description, cpu.cores, cpu.type_code, cpu.speed,
+                   cpu.model, '', '', '', '', '', '')
 
         for hdd in self.hdds:
-            hdd_vars = [self.location, computer_id, 'hd', hdd.get('id'), hdd.get('serial'), hdd.get('size'), '1',
-                        hdd.get('wipe_status_number'), hdd.get('employee'), hdd.get('wipe_status'),
-                        hdd.get('wipe_started'), hdd.get('wipe_finished'),
-                        hdd.get('type'), hdd.get('wipe_method'), '']
-            self._hdd_vars.append(hdd_vars)
+            yield (location, computer_id, 'hd', hdd.id, hdd.serial, hdd.size, '1', hdd.wipe_status_number,
+                   hdd.employee, hdd.wipe_status, hdd.wipe_started, hdd.wipe_finished, hdd.type, hdd.wipe_method, '')
+
+        yield (location, computer_id, 'bat', 'bat', '', '', '', self.battery.status, '', '', '', '', '', '',
+               self.battery.health)
 
-        self._battery_vars = [self.location, computer_id, 'bat', 'bat', '', '', '', self.battery.get('status'),
-                              '', '', '', '', '', '', self.battery.get('health')]
+        yield (location, computer_id, 'mem', 'mem', self.memory.capacity, self.memory.type,
+               '', '', '', '', '', '', '', '')
 
-        self._mem_vars = [self.location, computer_id, 'mem', 'mem', self.memory.get('capacity'),
-                          self.memory.get('type'), '', '', '', '', '', '', '', '']
+    # Serializes the components as the tab separated rows of an export file
+    def serialize(self) -> str:
+        return ''.join(format_row(row) for row in self.rows())
 
     # Writes the list of components into a file
     def export(self, file_dir: str) -> None:
         if os.path.exists(file_dir):
-            # Create file name with unique name.txt
-            file_name = f'SE_{datetime.date.today().strftime("%m-%d-%Y")}_{secrets.token_hex(8)}.txt'
-
-            with open(f'{file_dir}{file_name}', 'w') as file:
-                # Mask 0/ Comp
-                file.write('\t'.join(f'"{x}"' for x in self._comp_vars))
-                file.write('\n')
-
-                # CPUs
-                for cpu in self._cpu_vars:
-                    # Write out all the cpu elements into one line
-                    file.write('\t'.join(f'"{x}"' for x in cpu))
-                    file.write('\n')
-
-                # Hard Drives
-                for hdd in self._hdd_vars:
-                    # Write out all the hdd elements into one line
-                    file.write('\t'.join(f'"{x}"' for x in hdd))
-                    file.write('\n')
-
-                # Battery
-                file.write('\t'.join(f'"{x}"' for x in self._battery_vars))
-                file.write('\n')
-
-                # Memory
-                file.write('\t'.join(f'"{x}"' for x in self._mem_vars))
-                file.write('\n')
-
-            logger.info(f"Created file {file_name} with "
-                         f"Serial Number: '{self._comp_vars[4]}' and "
-                         f"Barcode: '{self._comp_vars[8]}' and "
-                         f"Computer Id: '{self._comp_vars[1]}'")
\ No newline at end of file
+            with ExportWriter(file_dir, max_devices=1) as writer:
+                writer.add(self)
+
+
+# Quotes each value and joins them into one line
+def format_row(row) -> str:
+    return '\t'.join(f'"{x}"' for x in row) + '\n'
+
+
+# Unique export file name, SE_<date>_<token>.txt
+def export_file_name() -> str:
+    return f'SE_{datetime.date.today().strftime("%m-%d-%Y")}_{secrets.token_hex(8)}.txt'
+
+
+# Buffers serialized devices and writes them into one export file per batch. A batch rolls over
+# once it holds max_devices devices or max_bytes characters. Each file is written in a single call
+# under a temporary name and renamed once complete, so the asset importer never sees a partial file.
+# on_flush(file_name, devices) is called after each file is in place.
+class ExportWriter:
+    def __init__(self, file_dir: str, max_devices: int = EXPORT_BATCH_DEVICES,
+                 max_bytes: int = EXPORT_BATCH_BYTES, on_flush=None):
+        self.file_dir = file_dir
+        self.on_flush = on_flush
+        self.max_devices = max(1, max_devices)
+        self.max_bytes = max_bytes
+        self.files = []
+        self._chunks = []
+        self._size = 0
+        self._devices = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only complete batches are written, a failed run leaves the input file to be processed again
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    # Adds a compiled device, returns the file name if the batch rolled over. text is the device already
+    # serialized, e.g. by a worker process.
+    def add(self, device: DeviceTemplate, text: str = None):
+        if text is None:
+            text = device.serialize()
+        self._chunks.append(text)
+        self._size += len(text)
+        self._devices.append(device)
+
+        if len(self._devices) >= self.max_devices or self._size >= self.max_bytes:
+            return self.flush()
+        return None
+
+    # Writes the buffered devices into a new export file, returns its name
+    def flush(self):
+        if not self._chunks:
+            return None
+
+        file_name = export_file_name()
+        temp_path = f'{self.file_dir}.{file_name}.tmp'
+        try:
+            with metrics.timer('export'):
+                with open(temp_path, 'w') as file:
+                    file.write(''.join(self._chunks))
+                os.replace(temp_path, f'{self.file_dir}{file_name}')
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        metrics.increment('devices', len(self._devices))
+        metrics.increment('export_files')
+
+        if logger.isEnabledFor(logging.INFO):
+            for device in self._devices:
+                logger.info("Created file %s with Serial Number: '%s' and Barcode: '%s' and Computer Id: '%s'",
+                            file_name, device.comp.serial, device.comp.barcode, device.computer_id)
+
+        self.files.append(file_name)
+        if self.on_flush is not None:
+            self.on_flush(file_name, self._devices)
+        self.discard()
+        return file_name
+
+    # Drops the buffered devices without writing them
+    def discard(self) -> None:
+        self._chunks = []
+        self._size = 0
+        self._devices = []
@@ -0,0 +1,256 @@
+import re
+import threading
+
+# Declarative field mappings of report schemas, compiled once per schema into plain Python functions.
+#
+# A schema maps each component (comp, cpus, storage, battery, memory) to a spec:
+#   record          namedtuple built from the fields, None for a plain tuple in field order
+#   slots           {"key": "CPU {number}", "count": 4, "empty": "N/A"} for components repeated per slot,
+#                   a record is extracted for every slot whose value is not empty
+#   slot_fields     report fields holding one comma separated entry per slot, split once per report
+#   fields          field name -> field spec, extracted in this order
+#   variants        [((method, argument), {field: spec}), ...] fields depending on the slot value, the
+#                   first variant whose slot.<method>(argument) is true is used, otherwise "otherwise"
+#   blank_together  fields set to '' together when any of them is '', their "finish" steps run otherwise
+#
+# A field spec reads its value from one source:
+#   key             report key, {number} is the slot number; "default" is used when the key is missing
+#   slot            True for the value of the slot itself
+#   slot_field      the entry of the current slot in one of the slot_fields
+#   field           an already extracted field
+#   value           a constant, {number} is the slot number when it is a string
+#   slot_number     True for the slot number as an integer
+# "unless": (key, value, result) gives result when the report key has that value, and "steps" are
+# applied in order:
+#   ('split', separator, index)  v.split(separator)[index], None splits on whitespace
+#   ('after', text)              v[v.find(text) + len(text):]
+#   ('slice', start, stop)       v[start:stop]
+#   ('replace', old, new)        {number} in old is the slot number
+#   ('strip',) ('upper',) ('title',)
+#   ('format', template)         template.format(v)
+#   ('regex', pattern)           first group of the first match, v unchanged when nothing matches
+#   ('call', function)           function(v, report)
+#   ('when', (method, argument), steps)  the steps only when v.<method>(argument) is true
+
+_schemas = {}
+_plans = {}
+_lock = threading.Lock()
+
+
+# Extraction functions of a compiled schema, each takes a report. source is the generated code.
+class ExtractionPlan:
+    def __init__(self, name: str, functions: dict, source: str):
+        self.name = name
+        self.source = source
+        self.comp = functions['comp']
+        self.cpus = functions['cpus']
+        self.storage = functions['storage']
+        self.battery = functions['battery']
+        self.memory = functions['memory']
+
+
+# Generates the body of one extraction function. Constants are inlined as literals, everything else
+# (records, regexes, functions) is bound to a name of the function's globals.
+class _Generator:
+    def __init__(self, namespace: dict):
+        self.namespace = namespace
+        self.lines = []
+        # (source expression, separator) -> local holding its split, shared by the fields of a slot
+        self.splits = {}
+
+    def bind(self, value) -> str:
+        for name, bound in self.namespace.items():
+            if bound is value:
+                return name
+        name = f'_g{len(self.namespace)}'
+        self.namespace[name] = value
+        return name
+
+    def emit(self, indent: int, line: str) -> None:
+        self.lines.append('    ' * indent + line)
+
+    def source(self, spec: dict, number, slot_fields: tuple) -> str:
+        if 'key' in spec:
+            key = spec['key'].format(number=number)
+            if 'default' in spec:
+                return f'report.get({key!r}, {spec["default"]!r})'
+            return f'report.get({key!r})'
+        if spec.get('slot'):
+            return 'slot'
+        if 'slot_field' in spec:
+            return f'tokens[{slot_fields.index(spec["slot_field"])}][{number - 1}]'
+        if 'field' in spec:
+            return f'f_{spec["field"]}'
+        if spec.get('slot_number'):
+            return repr(number)
+        value = spec['value']
+        return repr(value.format(number=number) if isinstance(value, str) else value)
+
+    # Expression of value after the steps. Steps using the value once are chained into the expression,
+    # the others first emit v = <expression so far> and continue from v.
+    def steps(self, value: str, steps, number, indent: int) -> str:
+        for step in steps:
+            kind = step[0]
+            if kind == 'split':
+                value = f'{value}.split({step[1]!r})[{step[2]!r}]'
+            elif kind == 'slice':
+                value = f'{value}[{step[1]!r}:{step[2]!r}]'
+            elif kind == 'replace':
+                value = f'{value}.replace({step[1].format(number=number)!r}, {step[2]!r})'
+            elif kind in ('strip', 'upper', 'title'):
+                value = f'{value}.{kind}()'
+            elif kind == 'format':
+                value = f'{step[1]!r}.format({value})'
+            elif kind == 'call':
+                value = f'{self.bind(step[1])}({value}, report)'
+            elif kind == 'after':
+                self.assign(indent, value)
+                value = f'v[v.find({step[1]!r}) + {len(step[1])}:]'
+            elif kind == 'regex':
+                pattern = self.bind(re.compile(step[1]))
+                self.assign(indent, value)
+                self.emit(indent, f'm = {pattern}.search(v)')
+                self.emit(indent, 'if m is not None:')
+                self.emit(indent + 1, 'v = m.group(1)')
+                value = 'v'
+            elif kind == 'when':
+                method, argument = step[1]
+                self.assign(indent, value)
+                self.emit(indent, f'if v.{method}({argument!r}):')
+                self.assign(indent + 1, self.steps('v', step[2], number, indent + 1))
+                value = 'v'
+            else:
+                raise ValueError(f"Unknown mapping step '{kind}'")
+        return value
+
+    def assign(self, indent: int, value: str) -> None:
+        if value != 'v':
+            self.emit(indent, f'v = {value}')
+
+    def field(self, name: str, spec: dict, number, slot_fields: tuple, indent: int) -> None:
+        share = True
+        if 'unless' in spec:
+            key, value, result = spec['unless']
+            self.emit(indent, f'if report.get({key.format(number=number)!r}) == {value!r}:')
+            self.emit(indent + 1, f'f_{name} = {result!r}')
+            self.emit(indent, 'else:')
+            indent += 1
+            # A split made in this branch is not set in the other one
+            share = False
+
+        source = self.source(spec, number, slot_fields)
+        steps = list(spec.get('steps', ()))
+        # Fields splitting the same value share one split
+        if share and steps and steps[0][0] == 'split' and source.isidentifier():
+            split = (source, steps[0][1])
+            if split not in self.splits:
+                self.splits[split] = f'parts{len(self.splits)}'
+                self.emit(indent, f'{self.splits[split]} = {source}.split({steps[0][1]!r})')
+            source = f'{self.splits[split]}[{steps[0][2]!r}]'
+            steps = steps[1:]
+
+        self.emit(indent, f'f_{name} = {self.steps(source, steps, number, indent)}')
+
+    def record(self, spec: dict, number, indent: int) -> None:
+        slot_fields = tuple(spec.get('slot_fields', ()))
+        self.splits = {}
+        for name, field in spec.get('fields', {}).items():
+            self.field(name, field, number, slot_fields, indent)
+
+        variants = spec.get('variants', ())
+        shared = self.splits
+        for position, ((method, argument), fields) in enumerate(variants):
+            self.emit(indent, f'{"if" if position == 0 else "elif"} slot.{method}({argument!r}):')
+            self.splits = dict(shared)
+            for name, field in fields.items():
+                self.field(name, field, number, slot_fields, indent + 1)
+        if variants:
+            self.emit(indent, 'else:')
+            self.splits = dict(shared)
+            for name, field in spec['otherwise'].items():
+                self.field(name, field, number, slot_fields, indent + 1)
+        self.splits = shared
+
+        together = spec.get('blank_together', ())
+        finishing = [(name, field['finish']) for name, field in self._all_fields(spec).items() if 'finish' in field]
+        if together:
+            blank = ' or '.join(f"f_{name} == ''" for name in together)
+            self.emit(indent, f'if {blank}:')
+            for name in together:
+                self.emit(indent + 1, f"f_{name} = ''")
+            self.emit(indent, 'else:')
+        for name, steps in finishing:
+            block = indent + 1 if name in together else indent
+            self.emit(block, f'f_{name} = {self.steps(f"f_{name}", steps, number, block)}')
+
+    @staticmethod
+    def _all_fields(spec: dict) -> dict:
+        fields = dict(spec.get('fields', {}))
+        for _, variant in spec.get('variants', ()):
+            fields.update(variant)
+        return fields
+
+    def values(self, spec: dict) -> str:
+        record = spec.get('record')
+        names = record._fields if record is not None else tuple(self._all_fields(spec))
+        values = ', '.join(f'f_{name}' for name in names)
+        if record is None:
+            return f'({values},)'
+        return f'{self.bind(record)}({values})'
+
+
+def _compile_component(component: str, spec: dict, namespace: dict) -> str:
+    generator = _Generator(namespace)
+    generator.emit(0, f'def extract_{component}(report):')
+    slots = spec.get('slots')
+    if slots is None:
+        generator.record(spec, None, 1)
+        generator.emit(1, f'return {generator.values(spec)}')
+        return '\n'.join(generator.lines)
+
+    slot_fields = tuple(spec.get('slot_fields', ()))
+    generator.emit(1, 'records = []')
+    if slot_fields:
+        generator.emit(1, 'tokens = None')
+    for number in range(1, slots['count'] + 1):
+        generator.emit(1, f'slot = report.get({slots["key"].format(number=number)!r})')
+        generator.emit(1, f'if slot != {slots["empty"]!r}:')
+        if slot_fields:
+            # Split the slot fields once for all the slots of the report
+            splits = ''.join(f"report.get({key!r}).split(','), " for key in slot_fields)
+            generator.emit(2, 'if tokens is None:')
+            generator.emit(3, f'tokens = ({splits})')
+        generator.record(spec, number, 2)
+        generator.emit(2, f'records.append({generator.values(spec)})')
+    generator.emit(1, 'return tuple(records)')
+    return '\n'.join(generator.lines)
+
+
+# Compiles a schema into an ExtractionPlan
+def compile_schema(name: str, schema: dict) -> ExtractionPlan:
+    namespace = {}
+    sources = [_compile_component(component, schema[component], namespace)
+               for component in ('comp', 'cpus', 'storage', 'battery', 'memory')]
+    source = '\n\n\n'.join(sources) + '\n'
+    exec(compile(source, f'<mapping {name}>', 'exec'), namespace)
+    functions = {component: namespace[f'extract_{component}']
+                 for component in ('comp', 'cpus', 'storage', 'battery', 'memory')}
+    return ExtractionPlan(name, functions, source)
+
+
+# Makes a schema available to Parser(schema=name), replacing the plan of an earlier one with that name
+def register_schema(name: str, schema: dict) -> None:
+    with _lock:
+        _schemas[name] = schema
+        _plans.pop(name, None)
+
+
+# Compiled plan of a registered schema, compiled on first use and cached
+def get_plan(name: str) -> ExtractionPlan:
+    with _lock:
+        plan = _plans.get(name)
+        if plan is None:
+            if name not in _schemas:
+                raise KeyError(f"Unknown report schema '{name}'")
+            plan = _plans[name] = compile_schema(name, _schemas[name])
+        return plan
@@ -0,0 +1,68 @@
+import os
+import time
+
+from defaults import STABLE_INTERVAL
+
+
+# Whether a directory entry name can be an export, decided from the name alone
+def is_input_name(name: str) -> bool:
+    return name.endswith('.json') and 'config.json' not in name
+
+
+# Lists the exports of an input directory with os.scandir. Names are filtered before anything is
+# stat'ed, and the stat of each entry comes with the directory listing on Windows. A file is only
+# returned once its size and mtime were the same for stable_interval seconds, so exports still being
+# copied onto the share are left alone until they are complete. A file last modified at least that long
+# ago is ready on the first scan, a fresh one once two scans stable_interval apart saw the same
+# signature, which is kept between scans. 0 returns every file right away.
+class InputScanner:
+    def __init__(self, directory: str, stable_interval: float = STABLE_INTERVAL):
+        self.directory = directory
+        self.stable_interval = stable_interval
+        # Name -> ((size, mtime), monotonic time that signature was first seen)
+        self._seen = {}
+        # Files seen but not stable yet after the last scan
+        self.waiting = 0
+
+    # Paths of the stable exports, raises OSError when the directory cannot be read
+    def scan(self) -> list:
+        now = time.monotonic()
+        wall_now = time.time()
+        ready = []
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not is_input_name(entry.name):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # Removed since the listing
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous = self._seen.get(entry.name)
+                if previous is not None and previous[0] == signature:
+                    since = previous[1]
+                elif wall_now - stat.st_mtime >= self.stable_interval:
+                    since = now - self.stable_interval
+                else:
+                    since = now
+                seen[entry.name] = (signature, since)
+                if now - since >= self.stable_interval:
+                    ready.append(os.path.join(self.directory, entry.name))
+
+        # Files gone from the directory are forgotten
+        self._seen = seen
+        self.waiting = len(seen) - len(ready)
+        return ready
+
+    # Stable exports for a single pass: when files are still changing it waits stable_interval once and
+    # returns what is stable by then, the rest is left for the next pass
+    def stable_files(self) -> list:
+        ready = self.scan()
+        if self.waiting:
+            time.sleep(self.stable_interval)
+            ready = self.scan()
+        return ready
@@ -0,0 +1,63 @@
+import json
+import logging
+import mmap
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# How exports are decoded:
+#   stream  ReportStream, one report at a time, memory use does not grow with the file size
+#   stdlib  the whole file read as bytes and decoded at once by json
+#   orjson  the whole file memory mapped and decoded at once by orjson, stdlib when it is not installed
+#   auto    orjson when it is installed, stdlib otherwise
+JSON_BACKENDS = ('stream', 'stdlib', 'orjson', 'auto')
+DEFAULT_JSON_BACKEND = 'stream'
+
+# Files at least this large are memory mapped for orjson instead of read into a bytes object
+MMAP_THRESHOLD = 1024 * 1024
+
+_BOM = b'\xef\xbb\xbf'
+
+
+# Backends that can run here, in JSON_BACKENDS order, without the 'auto' alias
+def available_backends() -> list:
+    return [backend for backend in JSON_BACKENDS if backend != 'auto' and (backend != 'orjson' or orjson)]
+
+
+# Backend actually used for a configured one
+def resolve_backend(backend: str) -> str:
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend '{backend}'")
+    if backend == 'auto':
+        return 'orjson' if orjson is not None else 'stdlib'
+    if backend == 'orjson' and orjson is None:
+        logger.warning("orjson is not installed - decoding with json")
+        return 'stdlib'
+    return backend
+
+
+def _decode_mapped(file) -> object:
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            start = len(_BOM) if view[:len(_BOM)] == _BOM else 0
+            with view[start:] as document:
+                return orjson.loads(document)
+
+
+# Decodes a whole JSON file with a loading backend ('stream' decodes like 'stdlib' here)
+def load_json(path: str, backend: str = 'auto'):
+    backend = resolve_backend(backend)
+    with open(path, 'rb') as file:
+        if backend == 'orjson':
+            # An empty file cannot be mapped, orjson reports it as invalid JSON like any other
+            if os.fstat(file.fileno()).st_size >= MMAP_THRESHOLD:
+                return _decode_mapped(file)
+            data = file.read()
+            return orjson.loads(data[len(_BOM):] if data.startswith(_BOM) else data)
+        # json detects the encoding of bytes itself, a BOM included
+        return json.loads(file.read())
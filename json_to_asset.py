@@ -1,29 +1,344 @@
+import functools
+import itertools
 import json
 import os
-from device import DeviceTemplate
-import shutil
+import re
+import time
+from contextlib import contextmanager
+from config import get_config
+from defaults import JSON_TO_ASSET_CONFIG_PATH
+from device import Battery, Comp, Cpu, DeviceTemplate, Hdd, Memory
+from field_mapping import get_plan, register_schema
+from json_backend import DEFAULT_JSON_BACKEND, load_json, resolve_backend
+from metrics import metrics
+from quarantine import describe_error
 
 import logging
 #import datetime
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-handler = logging.FileHandler('C:/secure_erase/processing.log')
-handler.setFormatter(formatter)
 
-logger.addHandler(handler)
+# Number of characters read at a time when streaming reports from an export
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+# A value cut off by the end of the buffer fails to decode within this many characters of the end (a
+# literal, number or escape), or as an unterminated string
+_TRUNCATED_TAIL = 8
+
+
+# Incrementally reads the objects of the report array of a Securaze export, one report at a time,
+# so the whole file never has to be held in memory. checkpoint() returns the point after the last
+# report read, a stream created with resume=checkpoint seeks there and continues with the next report.
+# A ReportList checkpoint has no position (offset -1), those reports are decoded again and skipped.
+class ReportStream:
+    def __init__(self, file, key: str = 'PCProduct', chunk_size: int = STREAM_CHUNK_SIZE, resume: tuple = None):
+        self.file = file
+        self.key = key
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self.buffer = ''
+        self.position = 0
+        # Reports read so far, including those skipped by resuming
+        self.reports = 0
+        # tell() of the last chunk read and where that chunk starts in the buffer
+        self._chunk_cookie = 0
+        self._chunk_start = 0
+
+    # Appends the next chunk to the buffer, dropping the text that was already consumed
+    def _fill(self) -> bool:
+        cookie = self.file.tell()
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        self._chunk_cookie = cookie
+        self._chunk_start = len(self.buffer) - len(chunk)
+        return True
+
+    # (reports, cookie, offset) of the point right after the last report read, None if it cannot be resumed
+    def checkpoint(self):
+        offset = self.position - self._chunk_start
+        if offset < 0:
+            return None
+        return self.reports, self._chunk_cookie, offset
+
+    def _restore(self) -> None:
+        self.reports, cookie, offset = self.resume
+        self.file.seek(cookie)
+        self.buffer = ''
+        self.position = 0
+        self._fill()
+        self.position = offset
+
+    # Returns the next non-whitespace character without consuming it, '' at end of file
+    def _peek(self) -> str:
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.position)
+        self.position += 1
+
+    # Moves the position right after the report array key. The keys of the top level object are decoded
+    # one by one and the values of the other keys skipped, so the key's text elsewhere is never matched.
+    def _seek_key(self) -> None:
+        self._expect('{')
+        if self._peek() == '}':
+            raise KeyError(self.key)
+        while True:
+            self._peek()
+            key = self._decode()
+            if key == self.key:
+                return
+            self._expect(':')
+            self._peek()
+            self._decode()
+            char = self._peek()
+            if char == '}':
+                raise KeyError(self.key)
+            if char != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.position)
+            self.position += 1
+
+    # Decodes the value starting at the current position, reading more of the file while it is cut off by
+    # the end of the buffer. Any other error is raised right away instead of buffering the rest of the file.
+    def _decode(self):
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as error:
+                incomplete = (error.pos >= len(self.buffer) - _TRUNCATED_TAIL
+                              or error.msg.startswith('Unterminated string'))
+                if not incomplete or not self._fill():
+                    raise
+                continue
+            self.position = end
+            return value
+
+    # Consumes the delimiter after a report, False at the end of the array
+    def _next(self) -> bool:
+        char = self._peek()
+        if char == ',':
+            self.position += 1
+            return True
+        if char == ']':
+            return False
+        raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.position)
+
+    def __iter__(self):
+        if self.resume is not None and self.resume[2] >= 0:
+            self._restore()
+            if not self._next():
+                return
+        else:
+            self._seek_key()
+            self._expect(':')
+            self._expect('[')
+            if self._peek() == ']':
+                return
+            if self.resume is not None:
+                for _ in range(self.resume[0]):
+                    self._peek()
+                    self._decode()
+                    self.reports += 1
+                    if not self._next():
+                        return
+
+        while True:
+            self._peek()
+            report = self._decode()
+            self.reports += 1
+            yield report
+            if not self._next():
+                return
+
+
+# Reports of an export decoded at once by a json_backend loader, with the checkpoint interface of
+# ReportStream. A checkpoint only counts the reports read, resuming skips that many.
+class ReportList:
+    def __init__(self, items: list, resume: tuple = None):
+        self.items = items
+        self.resume = resume
+        self.reports = 0
+
+    def checkpoint(self):
+        return self.reports, 0, -1
+
+    def __iter__(self):
+        self.reports = self.resume[0] if self.resume is not None else 0
+        for report in itertools.islice(self.items, self.reports, None):
+            self.reports += 1
+            yield report
+
+
+# Reports of an export file read by a json_backend: a ReportStream over the open file for 'stream',
+# otherwise a ReportList of the decoded document
+@contextmanager
+def open_reports(input_file_path: str, backend: str = DEFAULT_JSON_BACKEND, resume: tuple = None,
+                 key: str = 'PCProduct'):
+    backend = resolve_backend(backend)
+    if backend == 'stream':
+        with open(input_file_path, 'r') as file:
+            yield ReportStream(file, key=key, resume=resume)
+    else:
+        yield ReportList(load_json(input_file_path, backend)[key], resume)
+
+
+# Data Wipe result of a drive that passed, and lowest battery health that passes
+WIPE_SUCCESSFUL = 'Successful'
+BATTERY_HEALTH_THRESHOLD = 60
+
+ORIGINAL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+FINAL_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+_TIMESTAMP_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})')
+
+
+# Converts a wipe timestamp from ORIGINAL_TIME_FORMAT to FINAL_TIME_FORMAT. The fixed layout is
+# reordered without strptime, and results are memoized as the drives of a batch share timestamps.
+@functools.lru_cache(maxsize=4096)
+def convert_timestamp(value: str) -> str:
+    match = _TIMESTAMP_PATTERN.fullmatch(value)
+    if match is None:
+        return datetime.strptime(value, ORIGINAL_TIME_FORMAT).strftime(FINAL_TIME_FORMAT)
+
+    year, month, day, hour, minute, second = match.groups()
+    # Rejects out of range values the same way strptime does
+    datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+    return f'{day}-{month}-{year} {hour}:{minute}:{second}'
+
+
+# Battery status of a health value, '1' for 'Normal' or at least BATTERY_HEALTH_THRESHOLD
+def battery_status(health, report: dict) -> str:
+    try:
+        if health == 'Normal':
+            logger.warning("%s health value is Normal instead of an integer", report.get('Serial Number'))
+            return '1'
+        if int(health) >= BATTERY_HEALTH_THRESHOLD:
+            return '1'
+        return '0'
+    except ValueError:
+        logger.warning("%s health value is not an integer", report.get('Serial Number'))
+        return '0'
+
+
+def _timestamp(value: str, report: dict) -> str:
+    return convert_timestamp(value)
+
+
+# Report fields holding one 'Storage N / value' entry per storage slot
+SLOT_FIELDS = ('Storage Serial', 'Data Wipe Employee', 'Data Wipe', 'Data Wipe Method',
+               'Data Wipe Started', 'Data Wipe Finished')
+
+# Value of a 'Storage N / value' slot entry
+_SLOT_VALUE = (('split', '/', 1), ('strip',))
+_SLOT_TEXT = (('replace', 'Storage {number} / ', ''), ('strip',))
+
+# Field mapping of the Securaze PCProduct reports, see field_mapping for the spec
+SECURAZE_SCHEMA = {
+    "comp": {
+        "record": Comp,
+        "fields": {
+            "serial": {"key": 'Serial Number'},
+            "memory": {"key": 'RAM'},
+            "manufacturer": {"key": 'Vendor'},
+            # 'Name [Model ...]' keeps the first word in the brackets
+            "model": {"key": 'Model', "steps": [('when', ('endswith', ']'), [('after', '['), ('split', ' ', 0)])]},
+            "barcode": {"key": 'Asset ID', "unless": ('Asset ID', 'N/A', ''), "steps": [('split', ' ', -1)]},
+            "anumber": {"key": "'A' Number"},
+        },
+    },
+    "cpus": {
+        "record": Cpu,
+        "slots": {"key": 'CPU {number}', "count": 4, "empty": 'N/A'},
+        "fields": {
+            "id": {"value": 'cpu{number}'},
+            "description": {"slot": True},
+        },
+        "variants": [
+            # 'Apple M1 (8 cores)'
+            (('startswith', 'Apple M'), {
+                "type_code": {"slot": True, "steps": [('slice', 6, 8)]},
+                "model": {"slot": True, "steps": [('after', '('), ('slice', None, -1), ('title',)]},
+                "cores": {"slot": True, "steps": [('split', '(', 1), ('split', ' ', 0)]},
+                "speed": {"value": ''},
+            }),
+            # 'Intel(R) Core(TM) i5-8350U CPU @ 1.70GHz'
+            (('startswith', 'Intel(R)'), {
+                "type_code": {"slot": True, "steps": [('split', None, 2), ('slice', None, 2), ('upper',),
+                                                      ('format', 'C{}')]},
+                "model": {"slot": True, "steps": [('split', None, 2)]},
+                "cores": {"value": '0'},
+                "speed": {"slot": True, "steps": [('split', None, -1)]},
+            }),
+        ],
+        "otherwise": {"type_code": {"value": ''}, "model": {"value": ''}, "cores": {"value": ''},
+                      "speed": {"value": ''}},
+    },
+    "storage": {
+        "record": None,
+        "slots": {"key": 'Storage {number}', "count": 4, "empty": 'N/A'},
+        "slot_fields": SLOT_FIELDS,
+        "fields": {
+            "number": {"slot_number": True},
+            # 'Type: ssd, Interface: NVMe, Model: APPLE SSD 1, Size: 256 GB'
+            "type": {"slot": True, "steps": [('split', ',', 0), ('replace', 'Type:', ''), ('strip',), ('upper',)]},
+            "model": {"slot": True, "steps": [('split', ',', 2), ('replace', 'Model:', ''), ('strip',)]},
+            "size": {"slot": True, "steps": [('split', ',', 3), ('replace', 'Size:', ''), ('strip',)]},
+            "serial": {"slot_field": 'Storage Serial', "steps": _SLOT_TEXT},
+            "employee": {"slot_field": 'Data Wipe Employee', "steps": _SLOT_TEXT},
+            "wipe_result": {"slot_field": 'Data Wipe', "steps": _SLOT_VALUE},
+            "wipe_method": {"slot_field": 'Data Wipe Method', "unless": ('Data Wipe Method', 'N/A', ''),
+                            "steps": _SLOT_VALUE},
+            # The time zone suffix is dropped and the timestamps converted to FINAL_TIME_FORMAT
+            "wipe_started": {"slot_field": 'Data Wipe Started', "steps": _SLOT_VALUE + (('slice', None, -4),),
+                             "finish": [('call', _timestamp)]},
+            "wipe_finished": {"slot_field": 'Data Wipe Finished', "steps": _SLOT_VALUE + (('slice', None, -4),),
+                              "finish": [('call', _timestamp)]},
+        },
+        "blank_together": ('wipe_started', 'wipe_finished'),
+    },
+    "battery": {
+        "record": Battery,
+        "fields": {
+            "health": {"key": 'Battery Health', "default": 0},
+            "status": {"field": 'health', "steps": [('call', battery_status)]},
+        },
+    },
+    "memory": {
+        "record": Memory,
+        "fields": {
+            "capacity": {"key": 'RAM'},
+            # '16 GB LPDDR4 / 4266 MHz', the third word of the first part
+            "type": {"key": 'Configuration', "steps": [('split', '/', 0), ('split', ' ', 2)]},
+        },
+    },
+}
+
+DEFAULT_SCHEMA = 'securaze'
+register_schema(DEFAULT_SCHEMA, SECURAZE_SCHEMA)
+
 
 class Parser:
-    def __init__(self):
-        ...
+    def __init__(self, schema: str = DEFAULT_SCHEMA, json_backend: str = DEFAULT_JSON_BACKEND):
+        # Compiled extraction functions of the report schema
+        self.plan = get_plan(schema)
+        # json_backend the files are read with, see open_reports
+        self.json_backend = json_backend
 
     # Checks whether the file can be used by parser
     def can_parse(self, input_file_path: str) -> bool:
         # Skip if file path doesn't exist
         if not os.path.exists(input_file_path):
-            logger.error(f"File '{input_file_path}' does not exist")
+            logger.error("File '%s' does not exist", input_file_path)
             return False
 
         # Skip if not a .json
@@ -38,219 +353,161 @@ class Parser:
         return True
 
 
-    def parse_comp(self, report: dict) -> dict:
-        # Raw
-        serial = report.get('Serial Number')
-        memory = report.get('RAM')
-        manufacturer = report.get('Vendor')
-
-        # Extract model from string
-        model = report.get('Model')
-        if model.endswith("]"):
-            start_index = model.find('[')
-            model = model[start_index + 1:].split(" ")[0]
-        if report.get('Asset ID') == 'N/A':
-            logger.warning(f"Serial Number '{serial}' does not have a barcode")
-            barcode = ''
-        else:
-            barcode = report.get('Asset ID').split(" ")[-1]
-        Anumber = report.get("'A' Number")
-
-        comp = {"serial": serial,
-                "memory": memory,
-                "manufacturer": manufacturer,
-                "model": model,
-                "barcode": barcode,
-                "anumber": Anumber}
-        return comp
-
-    def parse_cpus(self, report: dict):
-        cpus = []
-        for number in range(1, 5):
-            cpu_string = report.get(f'CPU {number}')
-
-            if cpu_string == 'N/A':
-                continue
-
-            component_id = f'cpu{number}'
-            description = cpu_string
-            type_code = ''
-            if cpu_string.startswith('Apple M'):
-                type_code = cpu_string[6:8]
-                model = cpu_string[cpu_string.find('(') + 1: -1].title()
-                cores = cpu_string.split('(')[1].split(' ')[0]
-                speed = ''
-            if cpu_string.startswith('Intel(R)'):
-                type_code = f"C{cpu_string.split()[2][:2].upper()}"
-                model = cpu_string.split()[2]
-                cores = '0'
-                speed = cpu_string.split()[-1]
-
-            cpus.append({"id": component_id,
-                        "description": description,
-                         "type_code": type_code,
-                         "model": model,
-                         "cores": cores,
-                         "speed": speed})
-        return cpus
-
-    def parse_hdds(self, report: dict):
-        hdds = []
-        for number in range(1, 5):
-            hdd_string = report.get(f'Storage {number}')
-            if hdd_string == 'N/A':
-                continue
+    def parse_comp(self, report: dict) -> Comp:
+        return self.plan.comp(report)
 
-            component_id = f'hdd{number}'
+    def parse_cpus(self, report: dict) -> tuple:
+        return self.plan.cpus(report)
 
-            type = hdd_string.split(',')[0].replace('Type:', '').strip().upper()
-            model = hdd_string.split(',')[2].replace('Model:', '').strip()
-            size = hdd_string.split(',')[3].replace('Size:', '').strip()
+    # Raw fields of each used storage slot: number, type, model, size, serial, employee,
+    # wipe result ('Successful' or not), wipe method, wipe started and wipe finished
+    def iter_storage(self, report: dict):
+        return self.plan.storage(report)
 
-            serial = report.get('Storage Serial').split(',')[number - 1].\
-                replace(f"Storage {number} / ", "").strip()
-
-            employee = report.get('Data Wipe Employee').split(',')[number - 1].\
-                replace(f"Storage {number} / ", "").strip()
-
-            wipe_status = report.get('Data Wipe').split(',')[number - 1].split('/')[1].\
-                replace(f"Storage {number} / ", "").strip()
-
-            if wipe_status == "Successful":
+    def parse_hdds(self, report: dict) -> tuple:
+        hdds = []
+        for (number, type, model, size, serial, employee, wipe_result, wipe_method, wipe_started,
+             wipe_finished) in self.iter_storage(report):
+            if wipe_result == WIPE_SUCCESSFUL:
                 wipe_status = "PASSED"
                 wipe_status_number = "1"
             else:
                 wipe_status = "FAILED"
                 wipe_status_number = "0"
 
-            if report.get('Data Wipe Method') == 'N/A':
-                wipe_method = ''
-            else:
-                wipe_method = report.get('Data Wipe Method').split(',')[number - 1].split('/')[1].strip()
-
-            original_time_format = ('%Y-%m-%d %H:%M:%S')
-            final_time_format = ('%d-%m-%Y %H:%M:%S')
-
-            # The raw datetime string
-            started_string = report.get('Data Wipe Started').split(',')[number - 1].split('/')[1].strip()[:-4]
-            finished_string = report.get('Data Wipe Finished').split(',')[number - 1].split('/')[1].strip()[:-4]
-
-            if started_string == '' or finished_string == '':
-                wipe_started = ''
-                wipe_finished = ''
-            else:
-                # Convert to datetime
-                started_datetime = datetime.strptime(started_string, original_time_format)
-                finished_datetime = datetime.strptime(finished_string, original_time_format)
-
-                # Convert datetime format to final format
-                wipe_started = started_datetime.strftime(final_time_format)
-                wipe_finished = finished_datetime.strftime(final_time_format)
-
-            hdds.append({"id": component_id,
-                         "serial": serial,
-                         "type": type,
-                         "model": model,
-                         "size": size,
-                         "employee": employee,
-                         "wipe_status": wipe_status,
-                         "wipe_status_number": wipe_status_number,
-                         "wipe_method": wipe_method,
-                         "wipe_started": wipe_started,
-                         "wipe_finished": wipe_finished})
-
-        return hdds
-
-    def parse_battery(self, report: dict):
-        health = report.get('Battery Health', 0)
+            hdds.append(Hdd(id=f'hdd{number}',
+                            serial=serial,
+                            type=type,
+                            model=model,
+                            size=size,
+                            employee=employee,
+                            wipe_status=wipe_status,
+                            wipe_status_number=wipe_status_number,
+                            wipe_method=wipe_method,
+                            wipe_started=wipe_started,
+                            wipe_finished=wipe_finished))
+
+        return tuple(hdds)
+
+    def parse_battery(self, report: dict) -> Battery:
+        return self.plan.battery(report)
+
+    def parse_memory(self, report: dict) -> Memory:
+        return self.plan.memory(report)
+
+    # Builds a compiled device from a single report, None if the report has to be skipped
+    def parse_report(self, report: dict):
+        if report.get("'A' Number") == "N/A":
+            logger.warning("%s does not have an A Number - skipping", report.get('Serial Number'))
+            return None
+
+        if report.get('Asset ID') == "N/A":
+            logger.warning("%s does not have an A Barcode - skipping", report.get('Serial Number'))
+            return None
+
+        with metrics.timer('parse'):
+            device = DeviceTemplate(location=report.get("Securaze User"),
+                                    comp=self.parse_comp(report),
+                                    cpus=self.parse_cpus(report),
+                                    hdds=self.parse_hdds(report),
+                                    battery=self.parse_battery(report),
+                                    memory=self.parse_memory(report))
+        device.compile()
+        return device
+
+    # parse_report inside an error boundary: a report that fails to parse is logged and passed to
+    # on_error(report, reason, traceback) instead of raising, and None is returned
+    def try_parse_report(self, report, on_error=None):
         try:
-            if health == 'Normal':
-                logger.warning(f"{report.get('Serial Number')} health value is Normal instead of an integer")
-                status = '1'
-            elif int(health) >= 60:
-                status = '1'
-            else:
-                status = '0'
-        except ValueError:
-            status = '0'
-            logger.warning(f"{report.get('Serial Number')} health value is not an integer")
-
-        return {"health": health, "status": status}
-
-
-    def parse_memory(self, report: dict):
-        capacity = report.get('RAM')
-        type = report.get('Configuration').split('/')[0].split(' ')[2]
-        return {"capacity": capacity, "type": type}
-
-
-    def parse_file(self, input_file_path) -> DeviceTemplate:
-        devices = []
-        with open(input_file_path, 'r') as file:
-            reports = json.load(file)['PCProduct']
-            for report in reports:
-                if report.get("'A' Number") == "N/A":
-                    logger.warning(f"{report.get('Serial Number')} does not have an A Number - skipping")
-                    continue
-
-                if report.get('Asset ID') == "N/A":
-                    logger.warning(f"{report.get('Serial Number')} does not have an A Barcode - skipping")
-                    continue
-
-                device = DeviceTemplate()
-                device.location = report.get("Securaze User")
-                device.comp = self.parse_comp(report)
-                device.cpus = self.parse_cpus(report)
-                device.hdds = self.parse_hdds(report)
-                device.battery = self.parse_battery(report)
-                device.memory = self.parse_memory(report)
-                device.compile()
-                devices.append(device)
-        return devices
-
-
-def main():
-    # Config file path
-    config_path = 'S:/ftp/Securaze/config.json'
-
-    # Verify config exists
-    if not os.path.exists(config_path):
-        print("Config file doesn't exist")
+            return self.parse_report(report)
+        except Exception as error:
+            reason, details = describe_error(error)
+            serial = report.get('Serial Number') if isinstance(report, dict) else None
+            logger.error("Report of %s failed to parse: %s", serial, reason)
+            if on_error is not None:
+                on_error(report, reason, details)
+            return None
+
+    # Yields the compiled devices of a ReportStream or ReportList one report at a time, reports that
+    # fail to parse are skipped (see try_parse_report)
+    def iter_stream(self, stream, on_error=None):
+        # Time spent reading and decoding each report
+        started = time.perf_counter()
+        for report in stream:
+            metrics.observe('load', time.perf_counter() - started)
+            device = self.try_parse_report(report, on_error)
+            if device is not None:
+                yield device
+            started = time.perf_counter()
+
+    # resume is a checkpoint() of an earlier pass over the same file
+    def iter_file(self, input_file_path, resume: tuple = None, on_error=None):
+        with open_reports(input_file_path, self.json_backend, resume) as stream:
+            yield from self.iter_stream(stream, on_error)
+
+    def parse_file(self, input_file_path, resume: tuple = None, on_error=None) -> list:
+        return list(self.iter_file(input_file_path, resume, on_error))
+
+
+def main(workers=None, config_path=None, shard_size=None, profile_directory=None, json_backend=None):
+    # Imported here as processing depends on this module
+    from processing import process_folder
+
+    config = get_config(config_path, default_path=JSON_TO_ASSET_CONFIG_PATH)
+    if config is None:
         return
-
-    # Read config
-    with open(config_path, 'r') as config_file:
-        config = json.load(config_file)['io_config']
-        input_directory = config.get("input_directory")
-        if not input_directory.endswith("/"):
-            input_directory = input_directory + '/'
-        output_directory = config.get("output_directory")
-        if not output_directory.endswith("/"):
-            output_directory = output_directory + '/'
-        archive_directory = config.get("archive_directory")
-        if not archive_directory.endswith("/"):
-            archive_directory = archive_directory + '/'
-
-
-    # Create parser
-    parser = Parser()
-
-    # Parse each file in input directory
-    for file in os.listdir(input_directory):
-        input_file = f'{input_directory}{file}'
-        if parser.can_parse(input_file):
-            devices = parser.parse_file(input_file_path=input_file)
-            # Export each device from the report
-            for device in devices:
-                device.export(output_directory)
-
-            # Remove file from archive if exists
-            if os.path.isfile(f"{archive_directory}/{file}"):
-                os.remove(f"{archive_directory}/{file}")
-
-            # Move file to archive
-            shutil.move(input_file, archive_directory)
+    if workers is None:
+        workers = config['workers']
+    if shard_size is None:
+        shard_size = config['shard_size']
+    if profile_directory is None:
+        profile_directory = config['profile_directory']
+    if json_backend is None:
+        json_backend = config['json_backend']
+
+    # Parse, export and archive each file in input directory
+    summary = process_folder(config['input'], config['output'], config['archive'], workers=workers,
+                             batch_size=config['batch_size'], batch_bytes=config['batch_bytes'],
+                             index_path=config['index_path'], metrics_path=config['metrics_path'],
+                             output_format=config['output_format'], shard_size=shard_size,
+                             spool_directory=config['spool_directory'], profile_directory=profile_directory,
+                             json_backend=json_backend, stable_interval=config['stable_interval'],
+                             claim_files=config['claim_files'], node_id=config['node_id'],
+                             lease_ttl=config['lease_ttl'])
+    print(f"Processed {summary['files']} files and {summary['devices']} devices in {summary['seconds']}s "
+          f"({summary['files_per_second']} files/s, {summary['devices_per_second']} devices/s)")
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    import multiprocessing
+
+    from json_backend import JSON_BACKENDS
+    from logging_config import setup_logging
+
+    # Needed by the worker processes of the frozen executable
+    multiprocessing.freeze_support()
+    setup_logging()
+
+    arg_parser = argparse.ArgumentParser(description="Convert Securaze exports into asset import files")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="Number of worker processes, 0 for one per CPU (default: config or 1)")
+    arg_parser.add_argument("--config",
+                            help=f"Config file (default: $SECURE_ERASE_CONFIG or {JSON_TO_ASSET_CONFIG_PATH})")
+    arg_parser.add_argument("--shard-size", type=int, default=None,
+                            help="Split each file into shards of this many reports parsed in parallel, "
+                                 "0 to process whole files per worker (default: config or 0)")
+    arg_parser.add_argument("--profile", nargs='?', const='', metavar="DIRECTORY",
+                            help="Write call stats and allocations of each file into DIRECTORY "
+                                 "(default: config, or profiles in the log directory)")
+    arg_parser.add_argument("--json-backend", choices=JSON_BACKENDS, default=None,
+                            help="How exports are decoded (default: config or stream)")
+    args = arg_parser.parse_args()
+
+    profile_directory = None
+    if args.profile is not None:
+        from profiling import default_profile_directory
+
+        profile_directory = args.profile or default_profile_directory()
+    main(workers=args.workers, config_path=args.config, shard_size=args.shard_size,
+         profile_directory=profile_directory, json_backend=args.json_backend)
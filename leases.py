@@ -0,0 +1,147 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from defaults import LEASE_TTL
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Directory of the input directory holding a subdirectory of claimed files per node
+IN_PROGRESS_DIRECTORY = '.inprogress'
+LEASE_SUFFIX = '.lease'
+
+
+def default_node_id() -> str:
+    return socket.gethostname()
+
+
+# Claims input files for this node when several nodes watch the same input directory. A file is
+# claimed by renaming it into <input>/.inprogress/<node>/, which only one node can do, and a lease
+# file next to it is renewed while the file is processed. Files whose lease has not been renewed for
+# ttl seconds, left by a node that crashed or lost the share, are moved back into the input directory
+# by recover_stale() of any node and claimed again. Lease ages come from the file server's mtimes, so
+# clocks only need to agree to within a fraction of ttl.
+class FileClaims:
+    def __init__(self, input_directory: str, node_id: str = None, ttl: float = LEASE_TTL):
+        self.input_directory = input_directory
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.root = os.path.join(input_directory, IN_PROGRESS_DIRECTORY)
+        self.directory = os.path.join(self.root, self.node_id)
+        self._lock = threading.Lock()
+        # Claimed path -> lease path
+        self._held = {}
+        self._renewer = None
+
+    # Claims an input file, returns its path in this node's directory or None when another node has it
+    def claim(self, input_file: str):
+        os.makedirs(self.directory, exist_ok=True)
+        claimed = os.path.join(self.directory, os.path.basename(input_file))
+        lease = claimed + LEASE_SUFFIX
+        with self._lock:
+            if claimed in self._held or os.path.exists(claimed):
+                # A file of the same name is still in progress here, os.rename would replace it on POSIX
+                return None
+            try:
+                os.rename(input_file, claimed)
+            except FileNotFoundError:
+                return None
+            self._held[claimed] = lease
+            self._write_lease(lease)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, name='lease-renewer', daemon=True)
+                self._renewer.start()
+        metrics.increment('claimed_files')
+        return claimed
+
+    def _write_lease(self, lease: str) -> None:
+        temp_path = f'{lease}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({"node": self.node_id, "pid": os.getpid(),
+                       "claimed_at": datetime.datetime.now().isoformat()}, file)
+        os.replace(temp_path, lease)
+
+    # Ends the claim of a file. A file that was not processed (done False) goes back into the input
+    # directory so any node can try it again, a processed one has already been archived.
+    def release(self, claimed: str, done: bool = True) -> None:
+        with self._lock:
+            lease = self._held.pop(claimed, claimed + LEASE_SUFFIX)
+        if not done and os.path.exists(claimed):
+            try:
+                os.rename(claimed, os.path.join(self.input_directory, os.path.basename(claimed)))
+            except OSError as error:
+                logger.error("Failed to return '%s' to the input directory: %s", claimed, error)
+        try:
+            os.remove(lease)
+        except FileNotFoundError:
+            pass
+
+    # Renews the held leases until none are left
+    def _renew(self) -> None:
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                if not self._held:
+                    self._renewer = None
+                    return
+                leases = list(self._held.items())
+            for claimed, lease in leases:
+                try:
+                    os.utime(lease)
+                except FileNotFoundError:
+                    # Released since, or the lease expired and another node took the file back
+                    if os.path.exists(claimed):
+                        self._write_lease(lease)
+                except OSError as error:
+                    logger.warning("Failed to renew the lease of '%s': %s", claimed, error)
+
+    # Moves the files of expired leases back into the input directory, returns how many. A claimed
+    # file without a lease (its node stopped between the two steps) gets one, which expires in turn.
+    def recover_stale(self) -> int:
+        recovered = 0
+        now = time.time()
+        try:
+            nodes = [entry.path for entry in os.scandir(self.root) if entry.is_dir()]
+        except FileNotFoundError:
+            return 0
+
+        for node in nodes:
+            with os.scandir(node) as entries:
+                claimed_files = [entry.path for entry in entries
+                                 if not entry.name.endswith(LEASE_SUFFIX) and not entry.name.endswith('.tmp')]
+            for claimed in claimed_files:
+                with self._lock:
+                    if claimed in self._held:
+                        continue
+                lease = claimed + LEASE_SUFFIX
+                try:
+                    age = now - os.stat(lease).st_mtime
+                except FileNotFoundError:
+                    try:
+                        os.close(os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    except OSError:
+                        pass
+                    continue
+                if age < self.ttl:
+                    continue
+
+                input_file = os.path.join(self.input_directory, os.path.basename(claimed))
+                try:
+                    os.rename(claimed, input_file)
+                except OSError:
+                    # Recovered by another node first, or finished just now
+                    continue
+                try:
+                    os.remove(lease)
+                except FileNotFoundError:
+                    pass
+                recovered += 1
+                metrics.increment('recovered_files')
+                logger.warning("Recovered '%s' from node '%s', its lease expired %.0fs ago",
+                               input_file, os.path.basename(node), age - self.ttl)
+        return recovered
@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from defaults import STABLE_INTERVAL
+from logging_config import setup_logging, shutdown_logging
+from report_generator import write_export
+from service_loop import ServiceRunner
+from work_queue import WORK_QUEUE_DEBOUNCE
+
+# Files dropped per second in each stage, and seconds each stage drops files for
+DEFAULT_RATES = [1, 2, 5, 10]
+DEFAULT_DURATION = 10.0
+# Reports per dropped file and how often that size is dropped
+DEFAULT_SIZES = ['10:0.8', '100:0.15', '1000:0.05']
+# Seconds a stage waits for its backlog to drain before the next one starts
+DEFAULT_DRAIN_TIMEOUT = 60.0
+# Seconds between two looks at the output and archive directories, and between two backlog samples
+MONITOR_INTERVAL = 0.02
+BACKLOG_SAMPLE_INTERVAL = 0.25
+# A stage is sustainable while its backlog grows by less than this fraction of the drop rate. The growth
+# is measured over the second half of the stage, the first half fills the backlog up to rate x latency.
+BACKLOG_GROWTH_LIMIT = 0.1
+# Serial numbers of the reports of dropped file n start at n * FILE_SERIAL_RANGE, so every exported
+# device maps back to the file it came from
+FILE_SERIAL_RANGE = 100000
+
+
+# Parses '<reports>:<weight>' size mix entries
+def parse_sizes(sizes: list) -> list:
+    mix = []
+    for size in sizes:
+        reports, _, weight = size.partition(':')
+        mix.append((int(reports), float(weight or 1)))
+    return mix
+
+
+# Tracks every dropped file from its drop to its SE_*.txt exports becoming visible and its archiving.
+# A thread polls the output and archive directories, the first row of each new export file tells
+# which dropped file its devices came from.
+class DropMonitor:
+    def __init__(self, output_directory: str, archive_directory: str, interval: float = MONITOR_INTERVAL):
+        self.output_directory = output_directory
+        self.archive_directory = archive_directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        # File number -> monotonic drop time, time its last export became visible, time it was archived
+        self.dropped = {}
+        self.visible = {}
+        self.archived = {}
+        self._exports = set()
+        # (monotonic time, files dropped but not archived)
+        self.backlog = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def drop(self, number: int) -> None:
+        with self._lock:
+            self.dropped[number] = time.monotonic()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self.dropped) - len(self.archived)
+
+    def _poll_exports(self, now: float) -> None:
+        for entry in os.scandir(self.output_directory):
+            if entry.name in self._exports or not entry.name.startswith('SE_') or not entry.name.endswith('.txt'):
+                continue
+            self._exports.add(entry.name)
+            with open(entry.path, 'r') as file:
+                first_row = file.readline().split('\t')
+            # Computer row, the fifth column is the serial number 'C02<number>'
+            number = int(first_row[4].strip('"')[3:]) // FILE_SERIAL_RANGE
+            with self._lock:
+                self.visible[number] = now
+
+    def _poll_archive(self, now: float) -> None:
+        for entry in os.scandir(self.archive_directory):
+            if not entry.name.startswith('drop_') or not entry.name.endswith('.json'):
+                continue
+            number = int(entry.name[5:-5])
+            with self._lock:
+                if number not in self.archived:
+                    self.archived[number] = now
+
+    def _run(self) -> None:
+        sampled = 0.0
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            self._poll_exports(now)
+            self._poll_archive(now)
+            if now - sampled >= BACKLOG_SAMPLE_INTERVAL:
+                self.backlog.append((now, self.pending()))
+                sampled = now
+            self._stopped.wait(self.interval)
+
+    def start(self) -> 'DropMonitor':
+        self._thread = threading.Thread(target=self._run, name='drop-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    # Seconds from drop to the last export of each archived file of numbers, files without exportable
+    # devices count until they were archived
+    def latencies(self, numbers) -> list:
+        with self._lock:
+            return [self.visible.get(number, self.archived[number]) - self.dropped[number]
+                    for number in numbers if number in self.archived]
+
+    # Time the last of numbers was archived, None when none was
+    def last_archived(self, numbers):
+        with self._lock:
+            return max((self.archived[number] for number in numbers if number in self.archived), default=None)
+
+
+# Least squares slope of (time, value) samples, per second
+def slope(samples: list) -> float:
+    if len(samples) < 2:
+        return 0.0
+    times = [sample[0] for sample in samples]
+    values = [sample[1] for sample in samples]
+    mean_time = statistics.fmean(times)
+    mean_value = statistics.fmean(values)
+    variance = sum((moment - mean_time) ** 2 for moment in times)
+    if not variance:
+        return 0.0
+    return sum((moment - mean_time) * (value - mean_value) for moment, value in zip(times, values)) / variance
+
+
+def percentile(values: list, point: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(point / 100 * len(ordered) + 0.5)) - 1))]
+
+
+# Drops rate files per second for duration seconds into the input directory, each written into a staging
+# directory first and renamed into place the way a finished copy appears, then waits for the backlog to
+# drain. Returns the stage's results.
+def run_stage(monitor: DropMonitor, input_directory: str, staging_directory: str, rate: float, duration: float,
+              sizes: list, rng: random.Random, first_number: int, drain_timeout: float) -> dict:
+    count = max(1, int(rate * duration))
+    weights = [weight for _, weight in sizes]
+    numbers = list(range(first_number, first_number + count))
+    for number in numbers:
+        reports = rng.choices([reports for reports, _ in sizes], weights)[0]
+        write_export(os.path.join(staging_directory, f'drop_{number}.json'), reports, seed=number,
+                     start=number * FILE_SERIAL_RANGE)
+
+    started = time.monotonic()
+    for position, number in enumerate(numbers):
+        delay = started + position / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        os.replace(os.path.join(staging_directory, f'drop_{number}.json'),
+                   os.path.join(input_directory, f'drop_{number}.json'))
+        monitor.drop(number)
+    dropped = time.monotonic()
+    backlog_at_end = monitor.pending()
+
+    while monitor.pending() and time.monotonic() - dropped < drain_timeout:
+        time.sleep(0.1)
+    drained = time.monotonic()
+
+    samples = [sample for sample in monitor.backlog if started <= sample[0] <= dropped]
+    growth = slope([sample for sample in samples if sample[0] >= (started + dropped) / 2])
+    latencies = monitor.latencies(numbers)
+    completed = len(latencies)
+    last_done = monitor.last_archived(numbers) or drained
+    result = {"rate": rate,
+              "dropped": count,
+              "completed": completed,
+              "files_per_second": round(completed / (last_done - started), 2) if last_done > started else 0.0,
+              "backlog_max": max((value for _, value in samples), default=0),
+              "backlog_end": backlog_at_end,
+              "backlog_growth": round(growth, 3),
+              "drain_seconds": round(drained - dropped, 2)}
+    for point in (50, 90, 99, 100):
+        value = percentile(latencies, point)
+        result[f"p{point}" if point < 100 else "max"] = round(value, 3) if value is not None else None
+    result["sustainable"] = completed == count and growth <= BACKLOG_GROWTH_LIMIT * rate
+    return result
+
+
+# Runs the service loop against temporary directories through one stage per rate, returns the results
+def run_load_test(rates: list, duration: float, sizes: list, concurrency: int, stable_interval: float,
+                  rescan_interval: float, use_index: bool, drain_timeout: float, seed: int, keep: bool,
+                  debounce: float = WORK_QUEUE_DEBOUNCE) -> dict:
+    work_directory = tempfile.mkdtemp(prefix='se_load_')
+    directories = {name: os.path.join(work_directory, name, '')
+                   for name in ('in', 'out', 'archive', 'staging', 'logs')}
+    for directory in directories.values():
+        os.makedirs(directory)
+    # Log files as in production, so logging costs are part of the measurement
+    setup_logging(directories['logs'])
+
+    runner = ServiceRunner(directories['in'], directories['out'], directories['archive'], concurrency=concurrency,
+                           rescan_interval=rescan_interval, stable_interval=stable_interval, debounce=debounce,
+                           index_path=os.path.join(work_directory, 'processed.db') if use_index else None)
+    service = threading.Thread(target=runner.run_forever, name='service', daemon=True)
+    service.start()
+    monitor = DropMonitor(directories['out'], directories['archive']).start()
+
+    rng = random.Random(seed)
+    stages = []
+    first_number = 0
+    try:
+        for rate in rates:
+            result = run_stage(monitor, directories['in'], directories['staging'], rate, duration, sizes, rng,
+                               first_number, drain_timeout)
+            first_number += result['dropped']
+            stages.append(result)
+            print_stage(result)
+    finally:
+        runner.stop()
+        service.join()
+        monitor.stop()
+        shutdown_logging()
+        if keep:
+            print(f"Kept '{work_directory}'")
+        else:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    sustainable = [stage['rate'] for stage in stages if stage['sustainable']]
+    return {"stages": stages,
+            "max_sustainable_rate": max(sustainable) if sustainable else None,
+            "peak_files_per_second": max((stage['files_per_second'] for stage in stages), default=0.0)}
+
+
+def _seconds(value) -> str:
+    return '-' if value is None else f'{value:.3f}'
+
+
+def print_header() -> None:
+    print(f"{'rate/s':>7} {'dropped':>8} {'done':>6} {'done/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} "
+          f"{'backlog':>8} {'growth/s':>9} {'drain':>7}  sustainable")
+
+
+def print_stage(result: dict) -> None:
+    print(f"{result['rate']:>7g} {result['dropped']:>8} {result['completed']:>6} {result['files_per_second']:>8.2f} "
+          f"{_seconds(result['p50']):>8} {_seconds(result['p90']):>8} {_seconds(result['p99']):>8} "
+          f"{_seconds(result['max']):>8} {result['backlog_max']:>8} {result['backlog_growth']:>9.2f} "
+          f"{result['drain_seconds']:>6.1f}s  {'yes' if result['sustainable'] else 'NO'}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Load test of the watch and export service loop: drops "
+                                                     "synthetic exports at increasing rates and measures the "
+                                                     "drop to SE_*.txt latency and the backlog")
+    arg_parser.add_argument("--rates", type=float, nargs='+', default=DEFAULT_RATES,
+                            help="Files dropped per second, one stage each (default: 1 2 5 10)")
+    arg_parser.add_argument("--duration", type=float, default=DEFAULT_DURATION,
+                            help="Seconds each stage drops files for (default: 10)")
+    arg_parser.add_argument("--sizes", nargs='+', default=DEFAULT_SIZES, metavar="REPORTS:WEIGHT",
+                            help="Size mix of the dropped files (default: 10:0.8 100:0.15 1000:0.05)")
+    arg_parser.add_argument("--concurrency", type=int, default=4, help="Job slots of the service loop")
+    arg_parser.add_argument("--stable-interval", type=float, default=0.0,
+                            help=f"Stability interval of the scanner, drops are atomic so 0 by default "
+                                 f"(the service default is {STABLE_INTERVAL:g})")
+    arg_parser.add_argument("--rescan-interval", type=float, default=None,
+                            help="Seconds between directory scans (default: the service default)")
+    arg_parser.add_argument("--debounce", type=float, default=WORK_QUEUE_DEBOUNCE,
+                            help=f"Seconds a watched file has to stay quiet before it is queued "
+                                 f"(default: {WORK_QUEUE_DEBOUNCE:g})")
+    arg_parser.add_argument("--no-index", action='store_true', help="Run without a processed index")
+    arg_parser.add_argument("--drain-timeout", type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                            help="Seconds a stage waits for its backlog to drain (default: 60)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed of the size mix and the exports")
+    arg_parser.add_argument("--keep", action='store_true', help="Keep the temporary directories")
+    arg_parser.add_argument("--save", help="Write the results as JSON to this file")
+    args = arg_parser.parse_args()
+
+    print_header()
+    results = run_load_test(args.rates, args.duration, parse_sizes(args.sizes), args.concurrency,
+                            args.stable_interval, args.rescan_interval, not args.no_index, args.drain_timeout,
+                            args.seed, args.keep, args.debounce)
+    rate = results['max_sustainable_rate']
+    print(f"\nMax sustainable rate: {f'{rate:g} files/s' if rate is not None else 'none of the rates'}, "
+          f"peak throughput {results['peak_files_per_second']:.2f} files/s")
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
@@ -1,11 +1,131 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import tempfile
 
+# Directory of the log files, SECURE_ERASE_LOG_ROOT overrides it
+DEFAULT_LOG_ROOT = 'C:/secure_erase' if os.name == 'nt' else os.path.join(tempfile.gettempdir(), 'secure_erase')
+LOG_ROOT_VARIABLE = 'SECURE_ERASE_LOG_ROOT'
 
-def setup_logging():
-    logger = logging.getLogger("ser")
-    handler = logging.FileHandler('C:/secure_erase/history.log')
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    logger.setLevel(logging.INFO)
+# Log file of each module, modules not listed log into DEFAULT_LOG_FILE
+LOG_FILES = {'device': 'export.log',
+             'spool': 'export.log',
+             'json_to_asset': 'processing.log',
+             'processing': 'processing.log',
+             'secure_erase_automation': 'service.log',
+             'service_loop': 'service.log',
+             'work_queue': 'service.log',
+             'ser': 'history.log'}
+DEFAULT_LOG_FILE = 'processing.log'
 
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
\ No newline at end of file
+# Size based rotation of each log file
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+_listener = None
+_handlers = []
+_level = logging.INFO
+_worker_queue = None
+_worker_listener = None
+
+
+# Passes records of the modules routed to one log file
+class _LogFileFilter(logging.Filter):
+    def __init__(self, file_name: str):
+        super().__init__()
+        self.file_name = file_name
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return LOG_FILES.get(record.name.split('.')[0], DEFAULT_LOG_FILE) == self.file_name
+
+
+# Queues records without formatting them, the listener thread merges the message and its arguments.
+# Only the traceback of an exception is rendered right away as it refers to the caller's frames.
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def log_root() -> str:
+    return os.environ.get(LOG_ROOT_VARIABLE, DEFAULT_LOG_ROOT)
+
+
+# Routes every module's records through a queue to a background listener writing the rotating log
+# files under log_root. Calling it again keeps the existing setup.
+def setup_logging(root: str = None, level: int = logging.INFO, max_bytes: int = LOG_MAX_BYTES,
+                  backup_count: int = LOG_BACKUP_COUNT) -> logging.handlers.QueueListener:
+    global _listener, _level
+    if _listener is not None:
+        return _listener
+
+    root = root or log_root()
+    os.makedirs(root, exist_ok=True)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    for file_name in sorted(set(LOG_FILES.values()) | {DEFAULT_LOG_FILE}):
+        handler = logging.handlers.RotatingFileHandler(os.path.join(root, file_name), maxBytes=max_bytes,
+                                                       backupCount=backup_count)
+        handler.setFormatter(formatter)
+        handler.addFilter(_LogFileFilter(file_name))
+        _handlers.append(handler)
+
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(_LazyQueueHandler(log_queue))
+    root_logger.setLevel(level)
+    _level = level
+
+    _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+# Flushes the queued records and stops the listeners
+def shutdown_logging() -> None:
+    global _listener, _worker_listener, _worker_queue
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+        _worker_queue = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        for handler in _handlers:
+            handler.close()
+        _handlers.clear()
+
+
+# Queue worker processes log into, None when logging is not set up in this process
+def worker_log_queue():
+    global _worker_queue, _worker_listener
+    if _listener is None:
+        return None
+    if _worker_queue is None:
+        _worker_queue = multiprocessing.Queue(-1)
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, *_handlers, respect_handler_level=True)
+        _worker_listener.start()
+    return _worker_queue
+
+
+# Initializer of worker processes, sends their records to the parent's listener
+def configure_worker(log_queue, level: int = logging.INFO) -> None:
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root_logger.setLevel(level)
+
+
+# Initializer and its arguments for a ProcessPoolExecutor, (None, ()) when logging is not set up
+def worker_initializer():
+    log_queue = worker_log_queue()
+    if log_queue is None:
+        return None, ()
+    return configure_worker, (log_queue, _level)
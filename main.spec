@@ -43,3 +43,97 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+
+# Resident parser (daemon.py serve). It also takes the client commands, SecureEraseDaemonClient below is
+# the one to call per job.
+daemon_a = Analysis(
+    ['daemon.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=['win32timezone'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    win_no_prefer_redirects=False,
+    win_private_assemblies=False,
+    cipher=block_cipher,
+    noarchive=False,
+)
+daemon_pyz = PYZ(daemon_a.pure, daemon_a.zipped_data, cipher=block_cipher)
+
+daemon_exe = EXE(
+    daemon_pyz,
+    daemon_a.scripts,
+    daemon_a.binaries,
+    daemon_a.zipfiles,
+    daemon_a.datas,
+    [],
+    name='SecureEraseDaemon',
+    debug=False,
+    onefile=True,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    runtime_tmpdir=None,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+
+# Client of the resident parser (daemon_client.py process/ping/stop). Built from its own entry script
+# with the parser's dependencies excluded, as a onedir bundle without UPX, so a call does not unpack
+# anything and starts in milliseconds.
+client_a = Analysis(
+    ['daemon_client.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['json_to_asset', 'processing', 'columnar', 'field_mapping', 'processed_index', 'orjson',
+              'pyarrow', 'numpy', 'sqlite3', 'watchdog', 'win32timezone', 'tkinter', 'unittest', 'pydoc'],
+    win_no_prefer_redirects=False,
+    win_private_assemblies=False,
+    cipher=block_cipher,
+    noarchive=False,
+)
+client_pyz = PYZ(client_a.pure, client_a.zipped_data, cipher=block_cipher)
+
+client_exe = EXE(
+    client_pyz,
+    client_a.scripts,
+    [],
+    exclude_binaries=True,
+    name='SecureEraseDaemonClient',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+client_coll = COLLECT(
+    client_exe,
+    client_a.binaries,
+    client_a.zipfiles,
+    client_a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='SecureEraseDaemonClient',
+)
@@ -0,0 +1,180 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+# Seconds between two flushes of the metrics file
+METRICS_FLUSH_INTERVAL = 15.0
+PROMETHEUS_PREFIX = 'secure_erase'
+
+
+# Latency histogram with fixed buckets, the last count holds values above the largest bound
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimated quantile, the upper bound of the bucket holding it
+    def quantile(self, quantile: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        return {"count": self.count,
+                "sum": round(self.sum, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99),
+                "buckets": {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)}}
+
+
+# Process wide registry of stage latencies, counters and gauges
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    # Records the duration of the block into the stage histogram
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            uptime = time.time() - self.started
+            counters = dict(self.counters)
+            return {"timestamp": time.time(),
+                    "uptime_seconds": round(uptime, 3),
+                    "stages": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+                    "counters": counters,
+                    "gauges": dict(self.gauges),
+                    "rates": {f"{name}_per_second": round(value / uptime, 3) if uptime else 0.0
+                              for name, value in counters.items()}}
+
+    # Prometheus text exposition format
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f'# TYPE {PROMETHEUS_PREFIX}_stage_seconds histogram']
+        for stage, histogram in snapshot['stages'].items():
+            cumulative = 0
+            for bound, count in histogram['buckets'].items():
+                cumulative += count
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name}_total counter')
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}_total {value}')
+        for name, value in {**snapshot['gauges'], **snapshot['rates']}.items():
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge')
+            lines.append(f'{PROMETHEUS_PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the metrics to a .prom file in Prometheus text format, any other extension as JSON
+    def write(self, path: str) -> None:
+        if path.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=2)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+    # Flushes the metrics file every interval seconds until the returned event is set
+    def start_flusher(self, path: str, interval: float = METRICS_FLUSH_INTERVAL) -> threading.Event:
+        stopped = threading.Event()
+
+        # Writes every interval and once more when stopped, an unwritable path is retried the next time
+        def flush():
+            while True:
+                done = stopped.wait(interval)
+                try:
+                    self.write(path)
+                except OSError:
+                    pass
+                if done:
+                    return
+
+        threading.Thread(target=flush, name='metrics-flusher', daemon=True).start()
+        return stopped
+
+    # Serves /metrics (Prometheus) and /metrics.json on a local port in a background thread
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        # Imported here, http.server is slow to import and most runs never serve metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+
+metrics = Metrics()
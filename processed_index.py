@@ -0,0 +1,113 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+
+import wipe_stats
+from defaults import DEFAULT_INDEX_PATH
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# SHA-256 of a file's content, read in chunks
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Identity of a device, its serial, 'A' Number and barcode
+def device_key(device) -> str:
+    return f"{device.comp.serial}|{device.comp.anumber}|{device.comp.barcode}"
+
+
+# Identity of one wipe of a device, so a device wiped again later is still exported
+def device_fingerprint(device) -> str:
+    return '|'.join(f"{hdd.serial}/{hdd.wipe_status}/{hdd.wipe_finished}" for hdd in device.hdds)
+
+
+# Local SQLite index of the input files already processed, keyed by content hash, and of the devices
+# already exported, keyed by device_key. Lookups are primary key reads. Safe to share between threads,
+# each process opens its own. It also journals how far each unfinished input file got: the stream
+# checkpoint is committed in the same transaction as the devices of every export file written, and so
+# is the wipe statistics rollup (see wipe_stats).
+class ProcessedIndex:
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                     'hash TEXT PRIMARY KEY, name TEXT, devices INTEGER, processed_at TEXT)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS devices ('
+                                     'key TEXT PRIMARY KEY, fingerprint TEXT, export_file TEXT, exported_at TEXT)')
+            # The cookie is a text file position which can exceed a 64-bit integer, so it is kept as text
+            self._connection.execute('CREATE TABLE IF NOT EXISTS checkpoints ('
+                                     'hash TEXT PRIMARY KEY, name TEXT, reports INTEGER, cookie TEXT, '
+                                     'offset INTEGER, updated_at TEXT)')
+            wipe_stats.create_tables(self._connection)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def has_file(self, file_hash: str) -> bool:
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM files WHERE hash = ?', (file_hash,)).fetchone()
+        return row is not None
+
+    # Marks a file as done and drops its checkpoint
+    def mark_file(self, file_hash: str, name: str, devices: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                     (file_hash, name, devices, datetime.datetime.now().isoformat()))
+            self._connection.execute('DELETE FROM checkpoints WHERE hash = ?', (file_hash,))
+
+    # ReportStream.checkpoint() last committed for the file, None if it was never partially exported
+    def checkpoint(self, file_hash: str):
+        with self._lock:
+            row = self._connection.execute('SELECT reports, cookie, offset FROM checkpoints WHERE hash = ?',
+                                           (file_hash,)).fetchone()
+        if row is None:
+            return None
+        return row[0], int(row[1]), row[2]
+
+    # Whether this wipe of the device was already exported
+    def is_exported(self, device) -> bool:
+        with self._lock:
+            row = self._connection.execute('SELECT fingerprint FROM devices WHERE key = ?',
+                                           (device_key(device),)).fetchone()
+        return row is not None and row[0] == device_fingerprint(device)
+
+    # Records the devices written into an export file, in one transaction with the checkpoint of the
+    # input file they came from when one is given. Wipes not recorded before are added to the rollup.
+    def mark_exported(self, export_file: str, devices: list, file_hash: str = None, name: str = None,
+                      checkpoint: tuple = None) -> None:
+        exported_at = datetime.datetime.now().isoformat()
+        rows = [(device_key(device), device_fingerprint(device), export_file, exported_at) for device in devices]
+        with self._lock, self._connection:
+            # Takes the write lock before reading, so another process exporting the same wipe waits until
+            # this one is committed and then no longer counts it as new
+            self._connection.execute('BEGIN IMMEDIATE')
+            wipes = set()
+            new_wipes = []
+            for device, (key, fingerprint, _, _) in zip(devices, rows):
+                if (key, fingerprint) in wipes:
+                    continue
+                wipes.add((key, fingerprint))
+                row = self._connection.execute('SELECT fingerprint FROM devices WHERE key = ?', (key,)).fetchone()
+                if row is None or row[0] != fingerprint:
+                    new_wipes.append(device)
+            wipe_stats.record(self._connection, new_wipes)
+            self._connection.executemany('INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)', rows)
+            if file_hash is not None and checkpoint is not None:
+                reports, cookie, offset = checkpoint
+                self._connection.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)',
+                                         (file_hash, name, reports, str(cookie), offset, exported_at))
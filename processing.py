@@ -0,0 +1,344 @@
+import collections
+import contextlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from columnar import export_columnar
+from defaults import DEFAULT_OUTPUT_FORMAT, EXPORT_BATCH_BYTES, EXPORT_BATCH_DEVICES, LEASE_TTL
+from device import ExportWriter
+from input_scanner import InputScanner
+from json_backend import DEFAULT_JSON_BACKEND
+from json_to_asset import Parser, open_reports
+from leases import FileClaims
+from logging_config import worker_initializer
+from metrics import metrics
+from processed_index import ProcessedIndex, hash_file
+from profiling import profile_file
+from quarantine import Quarantine, quarantine_directory
+from spool import SpoolTransfer
+
+logger = logging.getLogger(__name__)
+
+# Reports parsed by a worker at a time when a file is split into shards
+SHARD_SIZE = 250
+# Shards in flight at a time, enough to keep every worker busy while the next shard is read
+SHARD_WINDOW = 2 * (os.cpu_count() or 1)
+
+# Parser, processed index and file claims kept by each worker process between files
+_worker_parser = None
+_worker_index = None
+_worker_claims = None
+
+
+# Resolves the configured worker count, 0 or None means one worker per CPU
+def resolve_workers(workers) -> int:
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+# Moves a processed input file into the archive, replacing an older copy with the same name
+def archive_file(input_file: str, archive_directory: str) -> None:
+    with metrics.timer('archive'):
+        archived_file = os.path.join(archive_directory, os.path.basename(input_file))
+        if os.path.isfile(archived_file):
+            os.remove(archived_file)
+        shutil.move(input_file, archive_directory)
+
+
+# Entry point of a worker process for one shard, returns the compiled devices with their export text
+# and the (report, reason, traceback) of the reports that failed to parse
+def _parse_shard(reports: list) -> tuple:
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = Parser()
+
+    parsed = []
+    failed = []
+    for report in reports:
+        device = _worker_parser.try_parse_report(report, lambda *failure: failed.append(failure))
+        if device is not None:
+            parsed.append((device, device.serialize()))
+    return parsed, failed
+
+
+# Splits the reports of a file into shards of shard_size, parses them in the pool and yields the devices
+# with their export text in the original report order, each shard as soon as it and those before it are
+# done. Only a few shards are in flight at a time and their devices are handed on right away, so memory
+# stays flat however large the file is. Raises if any shard failed. Reports that failed to parse are
+# skipped and passed to on_error(report, reason, traceback).
+def parse_sharded(executor: ProcessPoolExecutor, input_file: str, shard_size: int = SHARD_SIZE,
+                  json_backend: str = DEFAULT_JSON_BACKEND, on_error=None):
+    pending = collections.deque()
+
+    def collect(future) -> list:
+        parsed, failed = future.result()
+        if on_error is not None:
+            for failure in failed:
+                on_error(*failure)
+        return parsed
+
+    try:
+        with open_reports(input_file, json_backend) as reports:
+            shard = []
+            for report in reports:
+                shard.append(report)
+                if len(shard) >= shard_size:
+                    pending.append(executor.submit(_parse_shard, shard))
+                    shard = []
+                    if len(pending) >= SHARD_WINDOW:
+                        yield from collect(pending.popleft())
+            if shard:
+                pending.append(executor.submit(_parse_shard, shard))
+        while pending:
+            yield from collect(pending.popleft())
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+
+
+# Parses a file, exports its devices in batched files and archives it once the export is done.
+# With an index, files already processed are only archived and devices already exported are skipped,
+# and a file interrupted part way resumes after the reports of its last export file.
+# A csv or parquet output_format writes the whole file as one columnar file instead. With an executor
+# the reports of a txt export are parsed in shards across its processes and exported as the shards
+# complete, the file is only archived once every shard succeeded and a retry skips the devices the
+# index already has. With a profile_directory the call stats and allocations of the
+# file are written there (see profiling.profile_file), the shards parsed by other processes excluded.
+# Reports that fail to parse are written to a quarantine file in the archive's quarantine directory and
+# the rest of the file is still exported and archived.
+def process_file(parser: Parser, input_file: str, output_directory: str, archive_directory: str,
+                 batch_size: int = EXPORT_BATCH_DEVICES, batch_bytes: int = EXPORT_BATCH_BYTES,
+                 index: ProcessedIndex = None, output_format: str = DEFAULT_OUTPUT_FORMAT,
+                 executor: ProcessPoolExecutor = None, shard_size: int = SHARD_SIZE,
+                 profile_directory: str = None) -> int:
+    profiler = profile_file(input_file, profile_directory) if profile_directory else contextlib.nullcontext()
+    with metrics.timer('file'), profiler:
+        count = _process_file(parser, input_file, output_directory, archive_directory, batch_size, batch_bytes, index,
+                              output_format, executor, shard_size)
+    metrics.increment('files')
+    return count
+
+
+# process_file on input_file once this node claimed it (see leases.FileClaims), None when another node
+# claimed it first. A file that failed goes back into the input directory to be tried again.
+def process_claimed(claims: FileClaims, parser: Parser, input_file: str, output_directory: str,
+                    archive_directory: str, **options):
+    claimed = claims.claim(input_file)
+    if claimed is None:
+        logger.info("'%s' was claimed by another node - skipping", input_file)
+        return None
+    try:
+        count = process_file(parser, claimed, output_directory, archive_directory, **options)
+    except BaseException:
+        claims.release(claimed, done=False)
+        raise
+    claims.release(claimed)
+    return count
+
+
+def _process_file(parser: Parser, input_file: str, output_directory: str, archive_directory: str,
+                  batch_size: int, batch_bytes: int, index: ProcessedIndex, output_format: str,
+                  executor: ProcessPoolExecutor, shard_size: int) -> int:
+    file_hash = None
+    if index is not None:
+        file_hash = hash_file(input_file)
+        if index.has_file(file_hash):
+            logger.info("'%s' was already processed - archiving", input_file)
+            archive_file(input_file, archive_directory)
+            return 0
+
+    with Quarantine(quarantine_directory(archive_directory), input_file) as quarantine:
+        count = _export_file(parser, input_file, output_directory, batch_size, batch_bytes, index, output_format,
+                             executor, shard_size, file_hash, quarantine.add)
+
+    if index is not None:
+        index.mark_file(file_hash, os.path.basename(input_file), count)
+    archive_file(input_file, archive_directory)
+    return count
+
+
+def _export_file(parser: Parser, input_file: str, output_directory: str, batch_size: int, batch_bytes: int,
+                 index: ProcessedIndex, output_format: str, executor: ProcessPoolExecutor, shard_size: int,
+                 file_hash: str, on_error) -> int:
+    if output_format and output_format != DEFAULT_OUTPUT_FORMAT:
+        return export_columnar(parser, input_file, output_directory, output_format, on_error)
+    if executor is not None:
+        on_flush = index.mark_exported if index is not None else None
+        return _export_devices(parse_sharded(executor, input_file, shard_size, parser.json_backend, on_error),
+                               output_directory, batch_size, batch_bytes, index, on_flush)
+
+    with open_reports(input_file, parser.json_backend) as stream:
+        on_flush = None
+        if index is not None:
+            stream.resume = index.checkpoint(file_hash)
+            if stream.resume is not None:
+                logger.info("Resuming '%s' after %d reports", input_file, stream.resume[0])
+                metrics.increment('resumed_files')
+            name = os.path.basename(input_file)
+
+            # The devices of each export file are committed together with how far the stream got
+            def on_flush(file_name, devices):
+                index.mark_exported(file_name, devices, file_hash, name, stream.checkpoint())
+
+        devices = ((device, None) for device in parser.iter_stream(stream, on_error))
+        return _export_devices(devices, output_directory, batch_size, batch_bytes, index, on_flush)
+
+
+# Writes (device, text) pairs in batched export files, skipping the devices the index already exported
+def _export_devices(entries, output_directory: str, batch_size: int, batch_bytes: int, index: ProcessedIndex,
+                    on_flush) -> int:
+    count = 0
+    with ExportWriter(output_directory, max_devices=batch_size, max_bytes=batch_bytes, on_flush=on_flush) as writer:
+        for device, text in entries:
+            if index is not None and index.is_exported(device):
+                logger.info("Serial Number '%s' was already exported - skipping", device.comp.serial)
+                continue
+            writer.add(device, text)
+            count += 1
+    return count
+
+
+# Entry point of a worker process, returns the file with its device count, None when another node claimed
+# it, and processing time. claim is the (input directory, node id, lease ttl) of the FileClaims to use.
+def _process_file_worker(input_file: str, output_directory: str, archive_directory: str,
+                         batch_size: int, batch_bytes: int, index_path: str, output_format: str,
+                         profile_directory: str, json_backend: str, claim: tuple = None):
+    global _worker_parser, _worker_index, _worker_claims
+    if _worker_parser is None:
+        _worker_parser = Parser()
+    _worker_parser.json_backend = json_backend
+    if index_path and _worker_index is None:
+        _worker_index = ProcessedIndex(index_path)
+    if claim is not None and _worker_claims is None:
+        _worker_claims = FileClaims(*claim)
+
+    started = time.perf_counter()
+    options = {"batch_size": batch_size, "batch_bytes": batch_bytes, "index": _worker_index,
+               "output_format": output_format, "profile_directory": profile_directory}
+    if claim is not None:
+        count = process_claimed(_worker_claims, _worker_parser, input_file, output_directory, archive_directory,
+                                **options)
+    else:
+        count = process_file(_worker_parser, input_file, output_directory, archive_directory, **options)
+    return input_file, count, time.perf_counter() - started
+
+
+# Lists the exports of the input directory whose size and mtime stayed the same for stable_interval
+# seconds, waiting that long once when some are still being written (see InputScanner.stable_files)
+def list_input_files(input_directory: str, stable_interval: float = 0.0) -> list:
+    return InputScanner(input_directory, stable_interval).stable_files()
+
+
+# Processes every file of the input directory, in a process pool when more than one worker is configured.
+# A file is archived only after its own export succeeded, failed files stay in the input directory.
+# With a shard_size the files are processed one at a time instead, each split into shards of that many
+# reports parsed across the pool, which keeps every worker busy on a single large export.
+# With a spool_directory the exports are written there and moved to output_directory in the background.
+# With a profile_directory each file is profiled into its own report there. json_backend is how the
+# files are decoded, see json_to_asset.open_reports. With a stable_interval files still being written
+# are left for the next run, see list_input_files. With claim_files each file is claimed first, so several
+# nodes sharing the input directory process disjoint files (see leases.FileClaims).
+def process_folder(input_directory: str, output_directory: str, archive_directory: str, workers=1,
+                   batch_size: int = EXPORT_BATCH_DEVICES, batch_bytes: int = EXPORT_BATCH_BYTES,
+                   index_path: str = None, metrics_path: str = None,
+                   output_format: str = DEFAULT_OUTPUT_FORMAT, shard_size: int = 0,
+                   spool_directory: str = None, profile_directory: str = None,
+                   json_backend: str = DEFAULT_JSON_BACKEND, stable_interval: float = 0.0,
+                   claim_files: bool = False, node_id: str = None, lease_ttl: float = LEASE_TTL) -> dict:
+    workers = resolve_workers(workers)
+    parser = Parser(json_backend=json_backend)
+    claims = None
+    if claim_files:
+        claims = FileClaims(input_directory, node_id, lease_ttl)
+        claims.recover_stale()
+    input_files = list_input_files(input_directory, stable_interval)
+    transfer = None
+    if spool_directory:
+        # Also sends what an earlier run left in the spool
+        transfer = SpoolTransfer(spool_directory, output_directory).start()
+        output_directory = spool_directory
+    sharded = bool(shard_size) and workers > 1 and len(input_files) > 0
+    sequential = sharded or workers == 1 or len(input_files) <= 1
+    index = ProcessedIndex(index_path) if index_path and sequential else None
+
+    started = time.perf_counter()
+    files = 0
+    devices = 0
+    failed = 0
+
+    if sequential:
+        executor = None
+        if sharded:
+            initializer, initargs = worker_initializer()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        try:
+            options = {"batch_size": batch_size, "batch_bytes": batch_bytes, "index": index,
+                       "output_format": output_format, "executor": executor, "shard_size": shard_size or SHARD_SIZE,
+                       "profile_directory": profile_directory}
+            for input_file in input_files:
+                try:
+                    if claims is not None:
+                        count = process_claimed(claims, parser, input_file, output_directory, archive_directory,
+                                                **options)
+                        if count is None:
+                            continue
+                    else:
+                        count = process_file(parser, input_file, output_directory, archive_directory, **options)
+                    devices += count
+                    files += 1
+                except Exception as error:
+                    failed += 1
+                    logger.error("Failed to process '%s': %s", input_file, error)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    else:
+        # Worker processes send their log records to this process's log files
+        initializer, initargs = worker_initializer()
+        claim = (claims.input_directory, claims.node_id, claims.ttl) if claims is not None else None
+        with ProcessPoolExecutor(max_workers=min(workers, len(input_files)), initializer=initializer,
+                                 initargs=initargs) as executor:
+            futures = {executor.submit(_process_file_worker, input_file, output_directory, archive_directory,
+                                       batch_size, batch_bytes, index_path, output_format,
+                                       profile_directory, json_backend, claim): input_file
+                       for input_file in input_files}
+            for future in as_completed(futures):
+                try:
+                    input_file, count, elapsed = future.result()
+                except Exception as error:
+                    failed += 1
+                    logger.error("Failed to process '%s': %s", futures[future], error)
+                    continue
+                if count is None:
+                    continue
+                files += 1
+                devices += count
+                # Worker processes keep their own registry, record their results here
+                metrics.observe('file', elapsed)
+                metrics.increment('files')
+                metrics.increment('devices', count)
+                logger.info("Processed '%s' with %d devices in %.2fs", input_file, count, elapsed)
+
+    if index is not None:
+        index.close()
+    if transfer is not None:
+        transfer.stop()
+
+    elapsed = time.perf_counter() - started
+    summary = {"files": files,
+               "failed": failed,
+               "devices": devices,
+               "workers": workers,
+               "seconds": round(elapsed, 3),
+               "files_per_second": round(files / elapsed, 2) if elapsed else 0.0,
+               "devices_per_second": round(devices / elapsed, 2) if elapsed else 0.0}
+    logger.info("Processed %d files (%d failed) and %d devices with %d workers in %.2fs: %s files/s, %s devices/s",
+                files, failed, devices, workers, elapsed, summary['files_per_second'], summary['devices_per_second'])
+    if metrics_path:
+        metrics.write(metrics_path)
+    return summary
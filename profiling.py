@@ -0,0 +1,87 @@
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from logging_config import log_root
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in the text report, per sort order, and allocation sites listed
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+# Frames kept per allocation by tracemalloc
+PROFILE_TRACE_FRAMES = 1
+
+# Profiled files are processed one at a time so the call stats and allocations of one are not mixed
+# with another's (tracemalloc is process wide and only one cProfile may be active since Python 3.12)
+_lock = threading.Lock()
+
+
+# Reports directory used by the --profile switches when no directory is given
+def default_profile_directory() -> str:
+    return os.path.join(log_root(), 'profiles')
+
+
+def _report_name(input_file: str) -> str:
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    return f'{stem}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}_{os.getpid()}'
+
+
+# Text report: the call stats sorted by cumulative and by own time, then the top allocation sites
+def _write_report(path: str, input_file: str, profiler: cProfile.Profile, snapshot, current: int, peak: int) -> None:
+    output = io.StringIO()
+    output.write(f"Profile of '{input_file}'\n")
+    output.write(f"Memory: {current / 1024:.1f} KiB still allocated, {peak / 1024:.1f} KiB peak\n\n")
+
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs()
+    for sort in ('cumulative', 'tottime'):
+        output.write(f"== Calls by {sort} ==\n")
+        stats.sort_stats(sort).print_stats(PROFILE_TOP_FUNCTIONS)
+
+    output.write("== Allocations still held at the end, by line ==\n")
+    for number, statistic in enumerate(snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS], 1):
+        frame = statistic.traceback[0]
+        output.write(f"{number:>3} {statistic.size / 1024:>10.1f} KiB {statistic.count:>9} blocks  "
+                     f"{frame.filename}:{frame.lineno}\n")
+
+    with open(path, 'w') as file:
+        file.write(output.getvalue())
+
+
+# Profiles the processing of one input file. Writes <file>_<time>_<pid>.prof, loadable with pstats or
+# snakeviz, and a .txt report of the slowest functions and largest allocations into directory.
+@contextmanager
+def profile_file(input_file: str, directory: str):
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__)))
+            if started_tracing:
+                tracemalloc.stop()
+
+            name = os.path.join(directory, _report_name(input_file))
+            try:
+                profiler.dump_stats(f'{name}.prof')
+                _write_report(f'{name}.txt', input_file, profiler, snapshot, current, peak)
+                logger.info("Wrote profile of '%s' to %s.txt", input_file, name)
+            except OSError as error:
+                logger.error("Failed to write profile of '%s': %s", input_file, error)
@@ -0,0 +1,62 @@
+import datetime
+import json
+import logging
+import os
+import traceback
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Subdirectory of the archive directory holding the quarantine files
+QUARANTINE_DIRECTORY = 'quarantine'
+
+
+# Short reason and full traceback of a report that failed to parse
+def describe_error(error: BaseException) -> tuple:
+    reason = traceback.format_exception_only(type(error), error)[-1].strip()
+    return reason, ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+def quarantine_directory(archive_directory: str) -> str:
+    return os.path.join(archive_directory, QUARANTINE_DIRECTORY, '')
+
+
+# Reports of one input file that failed to parse, written as JSON lines of the raw report with the
+# reason into <input stem>_<time>.quarantine.jsonl. The file is only created by the first failure,
+# and each line is flushed, so the reports quarantined before a crash are kept.
+class Quarantine:
+    def __init__(self, directory: str, input_file: str):
+        self.directory = directory
+        self.input_file = input_file
+        self.path = None
+        self.count = 0
+        self._file = None
+
+    def add(self, report, reason: str, details: str = None) -> None:
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(self.input_file))[0]
+            self.path = os.path.join(self.directory,
+                                     f'{stem}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.quarantine.jsonl')
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+        serial = report.get('Serial Number') if isinstance(report, dict) else None
+        entry = {"file": os.path.basename(self.input_file), "serial": serial, "reason": reason,
+                 "traceback": details, "quarantined_at": datetime.datetime.now().isoformat(), "report": report}
+        self._file.write(json.dumps(entry, default=str) + '\n')
+        self._file.flush()
+        self.count += 1
+        metrics.increment('quarantined_reports')
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.warning("Quarantined %d reports of '%s' in '%s'", self.count, self.input_file, self.path)
+
+    def __enter__(self) -> 'Quarantine':
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+# Hardware pools the synthetic reports are drawn from
+APPLE_MODELS = [('MacBook Air (M1, 2020) [MacBookAir10,1 A2337]', 'Apple M1 (8 cores)', 'LPDDR4X'),
+                ('MacBook Pro (14-inch, 2021) [MacBookPro18,3 A2442]', 'Apple M1 Pro (10 cores)', 'LPDDR5'),
+                ('MacBook Air (M2, 2022) [Mac14,2 A2681]', 'Apple M2 (8 cores)', 'LPDDR5')]
+INTEL_MODELS = [('Latitude 7490', 'Intel(R) Core(TM) i5-8350U CPU @ 1.70GHz', 'DDR4'),
+                ('ThinkPad T480', 'Intel(R) Core(TM) i7-8650U CPU @ 1.90GHz', 'DDR4'),
+                ('EliteBook 840 G5', 'Intel(R) Core(TM) i5-8250U CPU @ 1.60GHz', 'DDR4')]
+DRIVE_TYPES = [('ssd', 'NVMe', 'APPLE SSD AP0256Q'), ('ssd', 'SATA', 'SAMSUNG MZ7LN256'),
+               ('hdd', 'SATA', 'ST500LM030'), ('ssd', 'NVMe', 'PM981 NVMe 512GB')]
+WIPE_METHODS = ['NIST 800-88 Purge', 'NIST 800-88 Clear', 'Crypto Erase']
+EMPLOYEES = ['jdoe', 'asmith', 'mlee', 'kpatel', 'rgarcia']
+LOCATIONS = ['US-Station-1', 'US-Station-2', 'US-Station-3']
+
+
+# Builds one PCProduct report shaped like a Securaze export entry
+def generate_report(rng: random.Random, number: int) -> dict:
+    apple = rng.random() < 0.5
+    model, cpu, memory_type = rng.choice(APPLE_MODELS if apple else INTEL_MODELS)
+    ram = rng.choice(['8 GB', '16 GB', '32 GB'])
+    storage_count = rng.randint(1, 4)
+
+    report = {"Securaze User": rng.choice(LOCATIONS),
+              "Serial Number": f'C02{number:08d}',
+              "Vendor": 'Apple' if apple else rng.choice(['Dell', 'Lenovo', 'HP']),
+              "Model": model,
+              "RAM": ram,
+              # Some stations do not scan barcodes or record an 'A' Number
+              "Asset ID": 'N/A' if rng.random() < 0.05 else f'Barcode {400000 + number}',
+              "'A' Number": 'N/A' if rng.random() < 0.03 else f'A{700000 + number}',
+              "Battery Health": rng.choice(['N/A', 'Normal', str(rng.randint(30, 100)), str(rng.randint(60, 100))]),
+              "Configuration": f'{ram} {memory_type} / {rng.choice([2400, 3200, 4266])} MHz'}
+
+    for slot in range(1, 5):
+        report[f'CPU {slot}'] = cpu if slot == 1 else 'N/A'
+
+    serials, employees, statuses, methods, started, finished = [], [], [], [], [], []
+    wipe_start = datetime(2023, 1, 1) + timedelta(minutes=rng.randint(0, 500000))
+    employee = rng.choice(EMPLOYEES)
+    method = rng.choice(WIPE_METHODS)
+    for slot in range(1, 5):
+        if slot > storage_count:
+            report[f'Storage {slot}'] = 'N/A'
+            continue
+
+        drive_type, interface, drive_model = rng.choice(DRIVE_TYPES)
+        report[f'Storage {slot}'] = (f'Type: {drive_type}, Interface: {interface}, Model: {drive_model}, '
+                                     f'Size: {rng.choice([128, 256, 512, 1024])} GB')
+        prefix = f'Storage {slot} / '
+        serials.append(f'{prefix}S{number:07d}{slot}')
+        employees.append(f'{prefix}{employee}')
+        statuses.append(f"{prefix}{'Successful' if rng.random() < 0.95 else 'Failed'}")
+        methods.append(f'{prefix}{method}')
+
+        wipe_end = wipe_start + timedelta(seconds=rng.randint(30, 7200))
+        if rng.random() < 0.02:
+            # Interrupted wipes have no timestamps
+            started.append(f'{prefix} UTC')
+            finished.append(f'{prefix} UTC')
+        else:
+            started.append(f'{prefix}{wipe_start:%Y-%m-%d %H:%M:%S} UTC')
+            finished.append(f'{prefix}{wipe_end:%Y-%m-%d %H:%M:%S} UTC')
+
+    report['Storage Serial'] = ', '.join(serials)
+    report['Data Wipe Employee'] = ', '.join(employees)
+    report['Data Wipe'] = ', '.join(statuses)
+    report['Data Wipe Method'] = 'N/A' if rng.random() < 0.1 else ', '.join(methods)
+    report['Data Wipe Started'] = ', '.join(started)
+    report['Data Wipe Finished'] = ', '.join(finished)
+    return report
+
+
+# Builds a whole export, the same seed always gives the same reports
+def generate_export(reports: int, seed: int = 0, start: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {"PCProduct": [generate_report(rng, number) for number in range(start, start + reports)]}
+
+
+# Writes a synthetic export with the given number of reports
+def write_export(file_path: str, reports: int, seed: int = 0, start: int = 0) -> None:
+    with open(file_path, 'w') as file:
+        json.dump(generate_export(reports, seed=seed, start=start), file, indent=2)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic Securaze PCProduct export")
+    arg_parser.add_argument("output", help="Path of the .json file to write")
+    arg_parser.add_argument("--reports", type=int, default=1000, help="Number of reports (default: 1000)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = arg_parser.parse_args()
+    write_export(args.output, args.reports, seed=args.seed)
@@ -7,55 +7,17 @@ import win32wnet
 import servicemanager
 import socket
 import os
-import time
-import sys
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-import json
-from json_to_asset import Parser
-import shutil
-import secrets
+from config import DEFAULT_CONFIG_PATH, get_config
+from logging_config import setup_logging
+from processing import process_folder
+from profiling import default_profile_directory
+from service_loop import ServiceRunner
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-handler = logging.FileHandler('C:/secure_erase/service.log')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
-class MyHandler(FileSystemEventHandler):
-    def __init__(self, input_directory: str, output_directory: str, archive_directory: str):
-        self.input_directory = input_directory
-        self.output_directory = output_directory
-        self.archive_directory = archive_directory
-
-        # Create parser
-        self.parser = Parser()
-
-
-    def on_created(self, event):
-        logger.info(f"on created called {time.time()}")
-        logger.debug( f"Path '{self.input_directory}' exists: {os.path.exists(self.input_directory)}")
-        # Parse each file in input directory
-        for file in os.listdir(self.input_directory):
-            input_file = f'{self.input_directory}{file}'
-            logger.info(f"File: {self.input_directory}{file}")
-            if not input_file.endswith('.json'):
-                continue
-
-            if self.parser.can_parse(input_file):
-                devices = self.parser.parse_file(input_file_path=input_file)
-
-                # Export each device from the report
-                for device in devices:
-                    device.export(self.output_directory)
-
-            # Move file to archive
-            if os.path.exists(input_file):
-                shutil.move(input_file, self.archive_directory)
-
 class SecureEraseSvc(win32serviceutil.ServiceFramework):
     _svc_name_ = "SecureEraseService"
     _svc_display_name_ = "Secure Erase Automation Service"
@@ -65,71 +27,34 @@ class SecureEraseSvc(win32serviceutil.ServiceFramework):
         self.hWaitStop = win32event.CreateEvent(None, 0, 0, None)
         socket.setdefaulttimeout(60)
         self.is_alive = True
+        self.runner = None
 
     def SvcStop(self):
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
         win32event.SetEvent(self.hWaitStop)
         self.is_alive = False
+        if self.runner is not None:
+            self.runner.stop()
 
     def SvcDoRun(self):
+        setup_logging()
         servicemanager.LogMsg(servicemanager.EVENTLOG_INFORMATION_TYPE,
                               servicemanager.PYS_SERVICE_STARTED,
                               (self._svc_name_, ''))
-        logger.debug(f"Calling main")
+        logger.debug("Calling main")
         #self.start_loop()
         self.main()
 
-    def get_config(self):
-        # Config file path
-        config_path = 'C:/secure_erase/config.json'
-
-        # Verify config exists
-        if not os.path.exists(config_path):
-            print("Config file doesn't exist")
-            return None
-
-        # Read config
-        with open(config_path, 'r') as config_file:
-            config = json.load(config_file)['io_config']
-            input_directory = config.get("input_directory")
-            if not input_directory.endswith("/"):
-                input_directory = input_directory + '/'
-            output_directory = config.get("output_directory")
-            if not output_directory.endswith("/"):
-                output_directory = output_directory + '/'
-            archive_directory = config.get("archive_directory")
-            if not archive_directory.endswith("/"):
-                archive_directory = archive_directory + '/'
-
-        return {"input": input_directory, "output": output_directory, "archive": archive_directory}
-
+    # Runs the asyncio service loop until SvcStop, changes to the config file are applied while it runs
     def start_loop(self):
-        config = self.get_config()
-        input_directory = config.get('input')
-        output_directory = config.get('output')
-        archive_directory = config.get('archive')
-
-        parser = Parser()
-
-        while self.is_alive:
-            if os.path.exists(input_directory):
-                for file in os.listdir(input_directory):
-                    input_file = f'{input_directory}{file}'
-                    logger.info(f"File: {input_directory}{file}")
-                    if not input_file.endswith('.json'):
-                        continue
-
-                    if parser.can_parse(input_file):
-                        devices = parser.parse_file(input_file_path=input_file)
-
-                        # Export each device from the report
-                        for device in devices:
-                            device.export(output_directory)
+        config = get_config()
+        if config is None:
+            return
+        self.runner = ServiceRunner.from_config(config)
+        if not self.is_alive:
+            return
+        self.runner.run_forever()
 
-                    # Move file to archive
-                    if os.path.exists(input_file):
-                        shutil.move(input_file, archive_directory)
-            time.sleep(1)
     def connect(self):
         pass
 
@@ -138,35 +63,15 @@ class SecureEraseSvc(win32serviceutil.ServiceFramework):
 
 
     def main(self):
-        # Config file path
-        config_path = 'C:/secure_erase/config.json'
-
-        # Verify config exists
-        if not os.path.exists(config_path):
-            print("Config file doesn't exist")
+        config = get_config()
+        if config is None:
             return
+        input_directory = config.get('input')
 
-        # Read config
-        with open(config_path, 'r') as config_file:
-            config = json.load(config_file)['io_config']
-            input_directory = config.get("input_directory")
-            if not input_directory.endswith("/"):
-                input_directory = input_directory + '/'
-            output_directory = config.get("output_directory")
-            if not output_directory.endswith("/"):
-                output_directory = output_directory + '/'
-            archive_directory = config.get("archive_directory")
-            if not archive_directory.endswith("/"):
-                archive_directory = archive_directory + '/'
-
-
-        logger.debug(f"Input: {input_directory}")
-        logger.debug(f"Out: {output_directory}")
-        observer = Observer()
-        event_handler = MyHandler(input_directory, output_directory, archive_directory)
-
+        logger.debug("Input: %s", input_directory)
+        logger.debug("Out: %s", config.get('output'))
 
-        logger.debug(f"Before Path '{input_directory}' exists: {os.path.exists(input_directory)}")
+        logger.debug("Before Path '%s' exists: %s", input_directory, os.path.exists(input_directory))
         # Split the path into its components
         path_parts = os.path.split(input_directory)
 
@@ -178,71 +83,54 @@ class SecureEraseSvc(win32serviceutil.ServiceFramework):
             )
         except Exception as error:
             logger.error(error)
-        win32wnet.WNetAddConnection2(r'\\speg-file\usshared', 0, 0)
-        # logger.debug(f"After Path '{input_directory}' exists: {os.path.exists(input_directory)}")
-        # observer.schedule(event_handler, path=input_directory, recursive=False)
-        # observer.start()
-        # event_handler.on_created(None)  # Activate event upon init
-        #
-        #
-        # while self.is_alive:
-        #     time.sleep(1)
-        #
-        #
-        #
-        # observer.stop()
-        # observer.join()
-
-def get_config():
-    # Config file path
-    config_path = 'C:/secure_erase/config.json'
-
-    # Verify config exists
-    if not os.path.exists(config_path):
-        print("Config file doesn't exist")
-        return None
-
-    # Read config
-    with open(config_path, 'r') as config_file:
-        config = json.load(config_file)['io_config']
-        input_directory = config.get("input_directory")
-        if not input_directory.endswith("/"):
-            input_directory = input_directory + '/'
-        output_directory = config.get("output_directory")
-        if not output_directory.endswith("/"):
-            output_directory = output_directory + '/'
-        archive_directory = config.get("archive_directory")
-        if not archive_directory.endswith("/"):
-            archive_directory = archive_directory + '/'
+        try:
+            win32wnet.WNetAddConnection2(r'\\speg-file\usshared', 0, 0)
+        except Exception as error:
+            logger.error(error)
+        logger.debug("After Path '%s' exists: %s", input_directory, os.path.exists(input_directory))
 
-    return {"input": input_directory, "output": output_directory, "archive": archive_directory}
+        # Watch and process the input directory until the service is stopped
+        self.start_loop()
 
-def parse_folder():
-    config = get_config()
+def parse_folder(workers=None, config_path=None, profile_directory=None):
+    config = get_config(config_path)
+    if config is None:
+        return
     input_directory = config.get('input')
     output_directory = config.get('output')
     archive_directory = config.get('archive')
-
-    parser = Parser()
+    if workers is None:
+        workers = config.get('workers')
+    if profile_directory is None:
+        profile_directory = config.get('profile_directory')
 
     if os.path.exists(input_directory):
-        for file in os.listdir(input_directory):
-            input_file = f'{input_directory}{file}'
-            if not input_file.endswith('.json'):
-                continue
-
-            if parser.can_parse(input_file):
-                devices = parser.parse_file(input_file_path=input_file)
-
-                # Export each device from the report
-                for device in devices:
-                    device.export(output_directory)
+        process_folder(input_directory, output_directory, archive_directory, workers=workers,
+                       batch_size=config.get('batch_size'), batch_bytes=config.get('batch_bytes'),
+                       index_path=config.get('index_path'), metrics_path=config.get('metrics_path'),
+                       output_format=config.get('output_format'), shard_size=config.get('shard_size'),
+                       spool_directory=config.get('spool_directory'), profile_directory=profile_directory,
+                       json_backend=config.get('json_backend'),
+                       stable_interval=config.get('stable_interval'), claim_files=config.get('claim_files'),
+                       node_id=config.get('node_id'), lease_ttl=config.get('lease_ttl'))
 
-            # Move file to archive
-            if os.path.exists(input_file):
-                shutil.move(input_file, archive_directory)
 if __name__ == '__main__':
-    parse_folder()
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Process the configured input directory once")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="Number of worker processes, 0 for one per CPU (default: config or 1)")
+    arg_parser.add_argument("--config", help=f"Config file (default: $SECURE_ERASE_CONFIG or {DEFAULT_CONFIG_PATH})")
+    arg_parser.add_argument("--profile", nargs='?', const='', metavar="DIRECTORY",
+                            help="Write call stats and allocations of each file into DIRECTORY "
+                                 "(default: config, or profiles in the log directory)")
+    args = arg_parser.parse_args()
+
+    setup_logging()
+    profile_directory = None
+    if args.profile is not None:
+        profile_directory = args.profile or default_profile_directory()
+    parse_folder(workers=args.workers, config_path=args.config, profile_directory=profile_directory)
     # if len(sys.argv) == 1:
     #     # if os.environ.get('DEBUG', None):
     #     #     event_handler = MyHandler(input_directory='c:/temp/in/', output_directory='c:/temp/out/',
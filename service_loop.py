@@ -0,0 +1,478 @@
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DEFAULT_CONFIG_PATH, get_config, load_config, resolve_config_path
+from defaults import (DEFAULT_OUTPUT_FORMAT, EXPORT_BATCH_BYTES, EXPORT_BATCH_DEVICES, LEASE_TTL, OUTPUT_FORMATS,
+                      STABLE_INTERVAL)
+from input_scanner import InputScanner, is_input_name
+from json_backend import DEFAULT_JSON_BACKEND, JSON_BACKENDS
+from json_to_asset import Parser
+from leases import FileClaims
+from logging_config import setup_logging
+from metrics import METRICS_FLUSH_INTERVAL, metrics
+from processed_index import ProcessedIndex
+from processing import process_claimed, process_file
+from profiling import default_profile_directory
+from spool import SpoolTransfer
+from work_queue import WORK_QUEUE_DEBOUNCE, WorkQueue
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+# Default number of files parsed and exported at the same time
+SERVICE_CONCURRENCY = 4
+# Files waiting for a free job slot before the runner stops taking new ones
+SERVICE_QUEUE_SIZE = 64
+# Seconds between full scans of the input directory, catches files the watcher missed. Without
+# watchdog the scan is the only source of new files and runs every SERVICE_POLL_INTERVAL instead.
+SERVICE_RESCAN_INTERVAL = 30.0
+SERVICE_POLL_INTERVAL = 1.0
+# Threads of the job pool, concurrency can be raised up to this by a config reload
+SERVICE_MAX_THREADS = 32
+# Seconds between checks of the config file for changes
+CONFIG_RELOAD_INTERVAL = 5.0
+
+
+# Puts the exports reported by watchdog into the runner's event queue, from the observer thread
+class _EventForwarder(FileSystemEventHandler):
+    def __init__(self, events: WorkQueue):
+        self.events = events
+
+    def _put(self, path: str) -> None:
+        if is_input_name(os.path.basename(path)):
+            self.events.put(path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._put(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._put(event.dest_path)
+
+
+# Asyncio run loop of the service. New files are reported by watchdog when it is installed and by a
+# periodic rescan, at most concurrency of them are parsed and exported at a time in a thread pool.
+# Watchdog events go through a WorkQueue, so a file is only reported once no event arrived for it during
+# debounce seconds however many events its copy raises.
+# The job queue is bounded: when exports slow down (e.g. a slow output share) the runner stops taking
+# files until a slot frees up. stop() is safe to call from any thread. A runner created by from_config
+# reloads the config file while it runs and applies new directories, concurrency and batch sizes.
+# With a stable_interval events only trigger a scan, and a file is queued once its size and mtime
+# stayed the same for that long (see InputScanner), so exports still being copied are not parsed.
+# With claim_files several runners, on any number of machines, can watch the same input directory:
+# each file is claimed before it is processed and files of a node that died are recovered.
+# With a spool_directory jobs export there and a SpoolTransfer moves the files to the output share.
+class ServiceRunner:
+    def __init__(self, input_directory: str, output_directory: str, archive_directory: str,
+                 concurrency: int = SERVICE_CONCURRENCY, queue_size: int = SERVICE_QUEUE_SIZE,
+                 rescan_interval: float = None, batch_size: int = EXPORT_BATCH_DEVICES,
+                 batch_bytes: int = EXPORT_BATCH_BYTES, index_path: str = None, metrics_path: str = None,
+                 metrics_port: int = None, metrics_interval: float = METRICS_FLUSH_INTERVAL,
+                 output_format: str = DEFAULT_OUTPUT_FORMAT, spool_directory: str = None,
+                 profile_directory: str = None, json_backend: str = DEFAULT_JSON_BACKEND,
+                 stable_interval: float = STABLE_INTERVAL, claim_files: bool = False, node_id: str = None,
+                 lease_ttl: float = LEASE_TTL, debounce: float = WORK_QUEUE_DEBOUNCE):
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.archive_directory = archive_directory
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+        if rescan_interval is None:
+            rescan_interval = SERVICE_RESCAN_INTERVAL if Observer is not None else SERVICE_POLL_INTERVAL
+        self.rescan_interval = rescan_interval
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.index_path = index_path
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        self.output_format = output_format
+        self.spool_directory = spool_directory
+        self.profile_directory = profile_directory
+        self.stable_interval = stable_interval
+        self.claim_files = claim_files
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.debounce = debounce
+
+        self.config = None
+        self.config_path = None
+        # Profile directory given on the command line, kept over the config's on reloads
+        self._profile_override = None
+
+        self.parser = Parser(json_backend=json_backend)
+        self._scanner = InputScanner(input_directory, stable_interval)
+        self._claims = FileClaims(input_directory, node_id, lease_ttl) if claim_files else None
+        self._loop = None
+        self._stopping = None
+        self._wake = None
+        self._rescan = None
+        self._queue = None
+        self._executor = None
+        self._observer = None
+        self._events = None
+        self._index = None
+        self._transfer = None
+        # Indexes replaced by a config reload, closed once the jobs using them are done
+        self._retired_indexes = []
+        # Job slot -> worker task
+        self._workers = {}
+        # Paths reported but not queued yet, and paths queued or being processed
+        self._incoming = collections.deque()
+        self._pending = set()
+        self._stop_requested = False
+
+    # Runner for a config returned by config.load_config, the file at config_path is watched for changes.
+    # A profile_directory given in options overrides the config's, also after a reload.
+    @classmethod
+    def from_config(cls, config: dict, config_path: str = None, **options) -> 'ServiceRunner':
+        profile_override = options.pop('profile_directory', None)
+        runner = cls(config['input'], config['output'], config['archive'], concurrency=config['concurrency'],
+                     batch_size=config['batch_size'], batch_bytes=config['batch_bytes'],
+                     index_path=config['index_path'], metrics_path=config['metrics_path'],
+                     metrics_port=config['metrics_port'], output_format=config['output_format'],
+                     spool_directory=config['spool_directory'],
+                     profile_directory=profile_override or config['profile_directory'],
+                     json_backend=config['json_backend'], stable_interval=config['stable_interval'],
+                     claim_files=config['claim_files'], node_id=config['node_id'], lease_ttl=config['lease_ttl'],
+                     **options)
+        runner.config = config
+        runner.config_path = resolve_config_path(config_path)
+        runner._profile_override = profile_override
+        return runner
+
+    # Number of files reported or queued that are not done yet
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    # Reports a new or moved file, called from the event queue's thread. With a stable_interval the file
+    # may still be written, so the directory is scanned instead.
+    def notify(self, path: str) -> None:
+        if self._loop is not None:
+            if self.stable_interval:
+                self._loop.call_soon_threadsafe(self._rescan.set)
+            else:
+                self._loop.call_soon_threadsafe(self._add, path)
+
+    def stop(self) -> None:
+        self._stop_requested = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def run_forever(self) -> None:
+        asyncio.run(self.run())
+
+    def _add(self, path: str) -> None:
+        path = os.path.normpath(path)
+        if path in self._pending or not path.endswith('.json'):
+            return
+        # Claimed files moved into the in-progress directories of the nodes
+        if os.path.dirname(path) != os.path.normpath(self.input_directory):
+            return
+        self._pending.add(path)
+        metrics.set_gauge('queue_depth', len(self._pending))
+        self._incoming.append(path)
+        self._wake.set()
+
+    def _list_input(self) -> list:
+        try:
+            if self._claims is not None:
+                self._claims.recover_stale()
+            return self._scanner.scan()
+        except FileNotFoundError:
+            return []
+
+    # Settings of a job, taken when it starts so a config reload never mixes old and new ones
+    def _job_options(self) -> dict:
+        return {"output_directory": self.spool_directory or self.output_directory,
+                "archive_directory": self.archive_directory,
+                "batch_size": self.batch_size, "batch_bytes": self.batch_bytes, "index": self._index,
+                "output_format": self.output_format, "profile_directory": self.profile_directory,
+                "claims": self._claims}
+
+    # Runs in the thread pool, one file at a time per thread
+    def _process(self, input_file: str, options: dict) -> None:
+        if not os.path.exists(input_file) or not self.parser.can_parse(input_file):
+            return
+        claims = options.pop('claims')
+        if claims is not None:
+            count = process_claimed(claims, self.parser, input_file, **options)
+            if count is None:
+                return
+        else:
+            count = process_file(self.parser, input_file, **options)
+        logger.info("Processed '%s' with %d devices", input_file, count)
+
+    # (Re)starts watching the input directory, scans are the only source of files while it is missing
+    def _watch_input(self) -> None:
+        if Observer is None:
+            return
+        if self._observer is None:
+            self._events = WorkQueue(self.notify, workers=1, debounce=self.debounce, gauge='event_queue_depth')
+            self._observer = Observer()
+            self._observer.start()
+        self._observer.unschedule_all()
+        if os.path.exists(self.input_directory):
+            self._observer.schedule(_EventForwarder(self._events), path=self.input_directory, recursive=False)
+
+    # (Re)starts moving the spooled exports to the output directory, the previous transfer stops after
+    # its current pass and the files it did not move are picked up again if the spool stays the same
+    def _start_transfer(self) -> None:
+        if self._transfer is not None:
+            self._loop.run_in_executor(None, self._transfer.stop, False)
+            self._transfer = None
+        if self.spool_directory:
+            self._transfer = SpoolTransfer(self.spool_directory, self.output_directory).start()
+
+    # Starts a worker for each job slot below concurrency, workers above it exit after their current job
+    def _start_workers(self) -> None:
+        for slot in range(self.concurrency):
+            worker = self._workers.get(slot)
+            if worker is None or worker.done():
+                self._workers[slot] = asyncio.create_task(self._work(slot))
+
+    # Applies a reloaded config, metrics settings take effect after a restart
+    def _apply_config(self, config: dict) -> None:
+        previous, self.config = self.config, config
+        if (config['output'], config['spool_directory']) != (self.output_directory, self.spool_directory):
+            self.output_directory = config['output']
+            self.spool_directory = config['spool_directory']
+            self._start_transfer()
+        self.archive_directory = config['archive']
+        self.batch_size = config['batch_size']
+        self.batch_bytes = config['batch_bytes']
+        self.output_format = config['output_format']
+        self.profile_directory = self._profile_override or config['profile_directory']
+        self.stable_interval = self._scanner.stable_interval = config['stable_interval']
+        # Read by each job when it opens its file
+        self.parser.json_backend = config['json_backend']
+
+        if config['index_path'] != self.index_path:
+            self.index_path = config['index_path']
+            if self._index is not None:
+                self._retired_indexes.append(self._index)
+            self._index = ProcessedIndex(self.index_path) if self.index_path else None
+
+        claim = (config['claim_files'], config['node_id'], config['lease_ttl'])
+        if config['input'] != self.input_directory or claim != (self.claim_files, self.node_id, self.lease_ttl):
+            self.claim_files, self.node_id, self.lease_ttl = claim
+            # Jobs already running release their files through the FileClaims they started with
+            self._claims = FileClaims(config['input'], self.node_id, self.lease_ttl) if self.claim_files else None
+
+        if config['input'] != self.input_directory:
+            self.input_directory = config['input']
+            self._scanner = InputScanner(self.input_directory, self.stable_interval)
+            self._watch_input()
+            self._rescan.set()
+
+        if config['concurrency'] != self.concurrency:
+            self.concurrency = min(config['concurrency'], SERVICE_MAX_THREADS)
+            self._start_workers()
+
+        if previous is not None and (config['metrics_path'], config['metrics_port']) != (
+                previous['metrics_path'], previous['metrics_port']):
+            logger.warning("Metrics settings of '%s' take effect after a restart", self.config_path)
+
+        logger.info("Applied config '%s': watching '%s' with %d job slots", self.config_path,
+                    self.input_directory, self.concurrency)
+
+    # Checks the config file for changes, load_config only reads it again when its mtime or size changed
+    async def _reload_config(self) -> None:
+        while True:
+            await asyncio.sleep(CONFIG_RELOAD_INTERVAL)
+            try:
+                config = await self._loop.run_in_executor(self._executor, load_config, self.config_path)
+            except (OSError, ValueError) as error:
+                logger.error("Failed to reload config '%s': %s", self.config_path, error)
+                continue
+            if config is not self.config:
+                self._apply_config(config)
+
+    # Rescans the input directory periodically, watchdog events arrive in between. While files are
+    # waiting to become stable the next scan is after stable_interval.
+    async def _scan(self) -> None:
+        while True:
+            self._rescan.clear()
+            try:
+                for path in await self._loop.run_in_executor(self._executor, self._list_input):
+                    self._add(path)
+            except OSError as error:
+                logger.error("Failed to scan '%s': %s", self.input_directory, error)
+            interval = self.rescan_interval
+            if self._scanner.waiting:
+                interval = min(interval, self.stable_interval)
+            try:
+                await asyncio.wait_for(self._rescan.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # Moves reported files into the bounded job queue, waiting while it is full
+    async def _produce(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._incoming:
+                await self._queue.put(self._incoming.popleft())
+
+    async def _work(self, slot: int) -> None:
+        while slot < self.concurrency:
+            path = await self._queue.get()
+            try:
+                await self._loop.run_in_executor(self._executor, self._process, path, self._job_options())
+            except Exception as error:
+                logger.error("Failed to process '%s': %s", path, error)
+            finally:
+                self._pending.discard(path)
+                metrics.set_gauge('queue_depth', len(self._pending))
+                self._queue.task_done()
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._rescan = asyncio.Event()
+        if self._stop_requested:
+            self._stopping.set()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        # One thread per job slot plus one for directory scans and config reloads, threads are only
+        # started when needed so the headroom for a raised concurrency costs nothing
+        self._executor = ThreadPoolExecutor(max_workers=max(self.concurrency, SERVICE_MAX_THREADS) + 1,
+                                            thread_name_prefix='service')
+        self._index = ProcessedIndex(self.index_path) if self.index_path else None
+        self._start_transfer()
+
+        flusher = None
+        if self.metrics_path:
+            flusher = metrics.start_flusher(self.metrics_path, self.metrics_interval)
+        server = None
+        if self.metrics_port:
+            server = metrics.serve(self.metrics_port)
+
+        self._watch_input()
+
+        tasks = [asyncio.create_task(self._scan()), asyncio.create_task(self._produce())]
+        if self.config_path is not None:
+            tasks.append(asyncio.create_task(self._reload_config()))
+        self._start_workers()
+        logger.info("Watching '%s' with %d job slots", self.input_directory, self.concurrency)
+
+        try:
+            await self._stopping.wait()
+        finally:
+            if self._observer is not None:
+                self._observer.stop()
+            tasks += self._workers.values()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Jobs already running finish their export and archive
+            await self._loop.run_in_executor(None, self._executor.shutdown)
+            if self._observer is not None:
+                self._observer.join()
+                self._events.stop()
+            if self._transfer is not None:
+                # Last pass over the spool, what the share does not take is sent by the next run
+                await self._loop.run_in_executor(None, self._transfer.stop)
+            for index in self._retired_indexes + [self._index]:
+                if index is not None:
+                    index.close()
+            self._observer = None
+            self._events = None
+            self._index = None
+            self._transfer = None
+            self._retired_indexes = []
+            self._workers = {}
+            if flusher is not None:
+                flusher.set()
+            if server is not None:
+                server.shutdown()
+            self._loop = None
+            logger.info("Service loop stopped")
+
+
+# Foreground runner, stops on Ctrl+C or SIGTERM
+def run_foreground(runner: ServiceRunner) -> None:
+    async def main():
+        if os.name != 'nt':
+            loop = asyncio.get_running_loop()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signal_number, runner.stop)
+        await runner.run()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Run the Secure Erase service loop in the foreground")
+    arg_parser.add_argument("--config",
+                            help=f"Config file, reloaded while running (default: $SECURE_ERASE_CONFIG or "
+                                 f"{DEFAULT_CONFIG_PATH}) unless --input, --output and --archive are given")
+    arg_parser.add_argument("--input", help="Input directory")
+    arg_parser.add_argument("--output", help="Output directory")
+    arg_parser.add_argument("--archive", help="Archive directory")
+    arg_parser.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY,
+                            help="Parallel jobs, ignored with a config file")
+    arg_parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE, help="Bounded job queue size")
+    arg_parser.add_argument("--rescan-interval", type=float, default=None,
+                            help="Seconds between full directory scans (default: 30, 1 without watchdog)")
+    arg_parser.add_argument("--index", help="Processed index database")
+    arg_parser.add_argument("--node-id", help="Claim files as this node so several runners can share --input "
+                                              "(default: no claiming)")
+    arg_parser.add_argument("--stable-interval", type=float, default=STABLE_INTERVAL,
+                            help="Seconds a file has to stay unchanged before it is processed (default: 2), "
+                                 "ignored with a config file")
+    arg_parser.add_argument("--spool", help="Local directory exports are written to before moving them to --output")
+    arg_parser.add_argument("--profile", nargs='?', const='', metavar="DIRECTORY",
+                            help="Write call stats and allocations of each file into DIRECTORY "
+                                 "(default: profiles in the log directory)")
+    arg_parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+                            help="SE_*.txt import files (default) or one csv/parquet file per input file, "
+                                 "ignored with a config file")
+    arg_parser.add_argument("--json-backend", choices=JSON_BACKENDS, default=DEFAULT_JSON_BACKEND,
+                            help="How exports are decoded (default: stream), ignored with a config file")
+    arg_parser.add_argument("--metrics-path", help="Metrics file, Prometheus text for .prom, JSON otherwise")
+    arg_parser.add_argument("--metrics-port", type=int, help="Serve /metrics and /metrics.json on this port")
+    args = arg_parser.parse_args()
+
+    directories = (args.input, args.output, args.archive)
+    if any(directories) and not all(directories):
+        arg_parser.error("--input, --output and --archive have to be given together")
+
+    setup_logging()
+    profile_directory = None
+    if args.profile is not None:
+        profile_directory = args.profile or default_profile_directory()
+
+    if all(directories):
+        runner = ServiceRunner(os.path.join(args.input, ''), os.path.join(args.output, ''),
+                               os.path.join(args.archive, ''), concurrency=args.concurrency,
+                               queue_size=args.queue_size, rescan_interval=args.rescan_interval,
+                               index_path=args.index, metrics_path=args.metrics_path,
+                               metrics_port=args.metrics_port, output_format=args.output_format,
+                               spool_directory=os.path.join(args.spool, '') if args.spool else None,
+                               profile_directory=profile_directory, json_backend=args.json_backend,
+                               stable_interval=args.stable_interval, claim_files=bool(args.node_id),
+                               node_id=args.node_id)
+    else:
+        config = get_config(args.config)
+        if config is None:
+            raise SystemExit(1)
+        runner = ServiceRunner.from_config(config, args.config, queue_size=args.queue_size,
+                                           rescan_interval=args.rescan_interval, profile_directory=profile_directory)
+    run_foreground(runner)
@@ -0,0 +1,116 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two passes over the spool, and the longest wait between retries while the share is down
+SPOOL_INTERVAL = 1.0
+SPOOL_MAX_BACKOFF = 300.0
+
+
+# Moves the export files written into a local spool directory to the output share in a background
+# thread, so parsing never waits on the network. The spool itself is the retry queue: a file only
+# leaves it once it is complete on the share, so files spooled during an outage, or before a crash,
+# are sent by the next pass or the next run. Files are copied under a temporary name and renamed, and
+# a file sent again after a crash replaces its own copy, so nothing is lost or duplicated.
+class SpoolTransfer:
+    def __init__(self, spool_directory: str, output_directory: str, interval: float = SPOOL_INTERVAL,
+                 max_backoff: float = SPOOL_MAX_BACKOFF):
+        self.spool_directory = spool_directory
+        self.output_directory = output_directory
+        self.interval = interval
+        self.max_backoff = max_backoff
+        # Consecutive failed passes and when the next one may start
+        self.failures = 0
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        os.makedirs(spool_directory, exist_ok=True)
+
+    # Complete files waiting in the spool, oldest first. Files still being written start with '.'.
+    def pending(self) -> list:
+        entries = [(entry.stat().st_mtime, entry.name) for entry in os.scandir(self.spool_directory)
+                   if entry.is_file() and not entry.name.startswith('.')]
+        return [name for _, name in sorted(entries)]
+
+    def _transfer(self, name: str) -> None:
+        temp_path = f'{self.output_directory}.{name}.tmp'
+        try:
+            shutil.copyfile(os.path.join(self.spool_directory, name), temp_path)
+            os.replace(temp_path, f'{self.output_directory}{name}')
+        except OSError:
+            try:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        os.remove(os.path.join(self.spool_directory, name))
+
+    # Moves every spooled file to the share, returns the number moved. After a failure the remaining
+    # files wait for the next pass, which is delayed exponentially up to max_backoff.
+    def transfer_once(self) -> int:
+        with self._lock:
+            if time.monotonic() < self.retry_at:
+                return 0
+
+            names = self.pending()
+            moved = 0
+            for name in names:
+                try:
+                    with metrics.timer('transfer'):
+                        self._transfer(name)
+                except OSError as error:
+                    self.failures += 1
+                    delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+                    self.retry_at = time.monotonic() + delay
+                    logger.warning("Failed to move %s to '%s', %d files waiting, retrying in %.0fs: %s",
+                                   name, self.output_directory, len(names) - moved, delay, error)
+                    break
+                moved += 1
+                self.failures = 0
+                metrics.increment('transferred_files')
+                logger.info("Moved %s to '%s'", name, self.output_directory)
+
+            metrics.set_gauge('spool_depth', len(names) - moved)
+            return moved
+
+    # Starts the next pass now instead of after interval, backoff still applies
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.transfer_once()
+            except OSError as error:
+                logger.error("Failed to read spool '%s': %s", self.spool_directory, error)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self) -> 'SpoolTransfer':
+        self._thread = threading.Thread(target=self._run, name='spool-transfer', daemon=True)
+        self._thread.start()
+        return self
+
+    # Stops the thread, with drain a last pass is made regardless of the backoff. Files that could
+    # not be moved stay in the spool for the next run.
+    def stop(self, drain: bool = True) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            self.retry_at = 0.0
+            try:
+                self.transfer_once()
+            except OSError as error:
+                logger.error("Failed to read spool '%s': %s", self.spool_directory, error)
@@ -0,0 +1,182 @@
+import argparse
+import collections
+import datetime
+import math
+import sqlite3
+
+# Daily rollup of the exported wipes, kept in the processed index database and updated in the same
+# transaction as the devices of every export file (see ProcessedIndex.mark_exported), so each wipe is
+# counted exactly once. Queries read the rows of one day and never depend on the history size.
+#
+# wipe_counts     passed and failed drives, and the sum and number of wipe durations, per day and
+#                 dimension value. The 'battery' dimension counts devices by battery status instead.
+# wipe_durations  histogram of the wipe durations per day and dimension value, for the percentiles
+
+# Dimensions of the rollup, 'all' has the single value ''
+DIMENSIONS = ('all', 'employee', 'wipe_method', 'type', 'battery')
+# Width of a duration bucket, percentiles are the upper bound of their bucket so within 10%
+DURATION_BUCKET_GROWTH = 1.1
+PERCENTILES = (50, 90, 99)
+
+DURATION_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    connection.execute('CREATE TABLE IF NOT EXISTS wipe_counts ('
+                       'day TEXT, dimension TEXT, value TEXT, passed INTEGER, failed INTEGER, '
+                       'durations INTEGER, duration_sum REAL, PRIMARY KEY (day, dimension, value))')
+    connection.execute('CREATE TABLE IF NOT EXISTS wipe_durations ('
+                       'day TEXT, dimension TEXT, value TEXT, bucket INTEGER, count INTEGER, '
+                       'PRIMARY KEY (day, dimension, value, bucket))')
+
+
+# Histogram bucket of a duration in seconds, 0 holds everything under a second
+def duration_bucket(seconds: float) -> int:
+    if seconds < 1:
+        return 0
+    return 1 + int(math.log(seconds, DURATION_BUCKET_GROWTH))
+
+
+def bucket_bound(bucket: int) -> float:
+    return DURATION_BUCKET_GROWTH ** bucket if bucket else 1.0
+
+
+# ISO day of an export timestamp ('dd-mm-yyyy HH:MM:SS'), None when it is blank or malformed
+def wipe_day(value: str):
+    if not value or len(value) < 10:
+        return None
+    return f'{value[6:10]}-{value[3:5]}-{value[0:2]}'
+
+
+# Seconds between the start and end of a wipe, None when either is missing or they are out of order
+def wipe_duration(started: str, finished: str):
+    try:
+        seconds = (datetime.datetime.strptime(finished, DURATION_TIME_FORMAT)
+                   - datetime.datetime.strptime(started, DURATION_TIME_FORMAT)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds >= 0 else None
+
+
+# Adds the drives and battery of devices to the rollup. Runs inside the caller's transaction.
+def record(connection: sqlite3.Connection, devices: list) -> None:
+    today = datetime.date.today().isoformat()
+    # (day, dimension, value) -> [passed, failed, durations, duration_sum]
+    counts = collections.defaultdict(lambda: [0, 0, 0, 0.0])
+    buckets = collections.Counter()
+
+    for device in devices:
+        device_day = None
+        for hdd in device.hdds:
+            day = wipe_day(hdd.wipe_finished) or today
+            device_day = max(device_day or day, day)
+            passed = hdd.wipe_status == 'PASSED'
+            duration = wipe_duration(hdd.wipe_started, hdd.wipe_finished)
+            for dimension, value in (('all', ''), ('employee', hdd.employee), ('wipe_method', hdd.wipe_method),
+                                     ('type', hdd.type)):
+                key = (day, dimension, value or '')
+                entry = counts[key]
+                entry[0 if passed else 1] += 1
+                if duration is not None:
+                    entry[2] += 1
+                    entry[3] += duration
+                    buckets[key + (duration_bucket(duration),)] += 1
+
+        # Counted on the day of the device's last wipe
+        if device.battery.status is not None:
+            entry = counts[(device_day or today, 'battery', '')]
+            entry[0 if device.battery.status == '1' else 1] += 1
+
+    connection.executemany('INSERT INTO wipe_counts VALUES (?, ?, ?, ?, ?, ?, ?) '
+                           'ON CONFLICT (day, dimension, value) DO UPDATE SET '
+                           'passed = passed + excluded.passed, failed = failed + excluded.failed, '
+                           'durations = durations + excluded.durations, '
+                           'duration_sum = duration_sum + excluded.duration_sum',
+                           [key + tuple(entry) for key, entry in counts.items()])
+    connection.executemany('INSERT INTO wipe_durations VALUES (?, ?, ?, ?, ?) '
+                           'ON CONFLICT (day, dimension, value, bucket) DO UPDATE SET count = count + excluded.count',
+                           [key + (count,) for key, count in buckets.items()])
+
+
+# Upper bound of the duration bucket holding each percentile, from (bucket, count) rows
+def percentiles(histogram: list, points: tuple = PERCENTILES) -> dict:
+    total = sum(count for _, count in histogram)
+    result = {}
+    if not total:
+        return {point: None for point in points}
+    for point in points:
+        rank = math.ceil(total * point / 100)
+        seen = 0
+        for bucket, count in sorted(histogram):
+            seen += count
+            if seen >= rank:
+                result[point] = bucket_bound(bucket)
+                break
+    return result
+
+
+# Read side of the rollup
+class WipeStats:
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, timeout=30)
+        with self._connection:
+            create_tables(self._connection)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    # One dict per value of the dimension on that day: passed, failed, average duration and percentiles
+    def summary(self, day: str, dimension: str = 'all') -> list:
+        histograms = collections.defaultdict(list)
+        for value, bucket, count in self._connection.execute(
+                'SELECT value, bucket, count FROM wipe_durations WHERE day = ? AND dimension = ?', (day, dimension)):
+            histograms[value].append((bucket, count))
+
+        rows = []
+        for value, passed, failed, durations, duration_sum in self._connection.execute(
+                'SELECT value, passed, failed, durations, duration_sum FROM wipe_counts '
+                'WHERE day = ? AND dimension = ? ORDER BY value', (day, dimension)):
+            row = {"value": value, "passed": passed, "failed": failed,
+                   "average_seconds": round(duration_sum / durations, 1) if durations else None}
+            for point, seconds in percentiles(histograms[value]).items():
+                row[f"p{point}_seconds"] = round(seconds, 1) if seconds is not None else None
+            rows.append(row)
+        return rows
+
+
+def _format_seconds(seconds) -> str:
+    return '-' if seconds is None else str(datetime.timedelta(seconds=round(seconds)))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Daily wipe statistics of the exported devices")
+    arg_parser.add_argument("--day", default=datetime.date.today().isoformat(),
+                            help="Day as YYYY-MM-DD (default: today)")
+    arg_parser.add_argument("--by", choices=DIMENSIONS, default='all', help="Break the counts down by")
+    arg_parser.add_argument("--index", help="Processed index database (default: index_path of the config)")
+    arg_parser.add_argument("--config", help="Config file (default: $SECURE_ERASE_CONFIG or "
+                                             "C:/secure_erase/config.json)")
+    args = arg_parser.parse_args()
+
+    index_path = args.index
+    if index_path is None:
+        from config import get_config
+
+        config = get_config(args.config)
+        if config is None:
+            raise SystemExit(1)
+        index_path = config['index_path']
+
+    stats = WipeStats(index_path)
+    rows = stats.summary(args.day, args.by)
+    stats.close()
+    if not rows:
+        print(f"No wipes recorded on {args.day}")
+        raise SystemExit(0)
+
+    print(f"{args.by:<24} {'passed':>8} {'failed':>8} {'average':>10} "
+          + ' '.join(f"{'p' + str(point):>10}" for point in PERCENTILES))
+    for row in rows:
+        print(f"{row['value'] or '-':<24} {row['passed']:>8} {row['failed']:>8} "
+              f"{_format_seconds(row['average_seconds']):>10} "
+              + ' '.join(f"{_format_seconds(row[f'p{point}_seconds']):>10}" for point in PERCENTILES))
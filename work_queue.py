@@ -0,0 +1,109 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Default number of worker threads and seconds a path has to stay quiet before it is handled
+WORK_QUEUE_WORKERS = 4
+WORK_QUEUE_DEBOUNCE = 1.0
+
+
+# Deduplicating, debounced queue of file paths drained by a fixed pool of worker threads.
+# A path is handed to the handler once no new event arrived for it during the debounce interval,
+# and never to two workers at the same time. The number of waiting paths is reported as the gauge.
+class WorkQueue:
+    def __init__(self, handler, workers: int = WORK_QUEUE_WORKERS, debounce: float = WORK_QUEUE_DEBOUNCE,
+                 gauge: str = 'queue_depth'):
+        self.handler = handler
+        self.debounce = debounce
+        self.gauge = gauge
+        self._condition = threading.Condition()
+        # Heap of (due time, path), entries superseded by a later event are skipped when popped
+        self._heap = []
+        # Path -> due time of its latest event
+        self._pending = {}
+        # Paths currently being handled
+        self._active = set()
+        self._running = True
+        self._threads = [threading.Thread(target=self._work, name=f'work-queue-{number}', daemon=True)
+                         for number in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    # Number of paths waiting to be handled
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    # Queues a path, or pushes back its due time if it is already waiting
+    def put(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        with self._condition:
+            if not self._running:
+                return False
+            due = time.monotonic() + self.debounce
+            self._pending[path] = due
+            heapq.heappush(self._heap, (due, path))
+            metrics.set_gauge(self.gauge, len(self._pending))
+            self._condition.notify()
+        return True
+
+    # Stops the workers, paths still waiting are dropped and picked up by the next scan
+    def stop(self, wait: bool = True) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    # Waits for the next due path, None once the queue is stopped. Must hold the condition.
+    def _next(self):
+        while self._running:
+            if not self._heap:
+                self._condition.wait()
+                continue
+
+            due, path = self._heap[0]
+            if self._pending.get(path) != due:
+                heapq.heappop(self._heap)
+                continue
+
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            if path in self._active:
+                # Another worker is still on it, look again after the debounce interval
+                due = time.monotonic() + self.debounce
+                self._pending[path] = due
+                heapq.heappush(self._heap, (due, path))
+                continue
+
+            del self._pending[path]
+            metrics.set_gauge(self.gauge, len(self._pending))
+            self._active.add(path)
+            return path
+        return None
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                path = self._next()
+            if path is None:
+                return
+
+            try:
+                self.handler(path)
+            except Exception as error:
+                logger.error("Failed to handle '%s': %s", path, error)
+            finally:
+                with self._condition:
+                    self._active.discard(path)